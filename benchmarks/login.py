@@ -0,0 +1,86 @@
+# login throughput under concurrent load, with the password pool stats at the end
+#
+# usage: DATABASE_URL=sqlite:///bench.db python benchmarks/login.py
+#        [--users 50] [--logins 500] [--concurrency 50]
+#
+# tune BCRYPT_ROUNDS, PASSWORD_POOL, PASSWORD_WORKERS and PASSWORD_MAX_CONCURRENCY
+# through the environment and compare the numbers
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'Bench@Passw0rd'
+
+
+async def run(users, logins, concurrency):
+    sys.path.insert(0, ROOT)
+
+    import httpx
+    from database import Base, engine, Session
+    from main import app
+    from tables.users import Users
+    from utils.passwords import password_hasher
+
+    Base.metadata.create_all(bind=engine)
+
+    hashed = await password_hasher.hash(PASSWORD)
+    emails = [f'login{i}@example.com' for i in range(users)]
+    with Session() as db:
+        existing = {email for (email,) in db.query(Users.email).filter(Users.email.in_(emails))}
+        db.add_all([
+            Users(username=f'login{i}', email=email, full_name='bench', password=hashed)
+            for i, email in enumerate(emails) if email not in existing
+        ])
+        db.commit()
+
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        remaining = logins
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                email = emails[remaining % users]
+                started = time.perf_counter()
+                response = await client.post('/api/v1/user/login', data={'email': email, 'password': PASSWORD},
+                                             headers={'x-forwarded-for': '127.0.0.1'})
+                latencies.append(time.perf_counter() - started)
+                if not response.json().get('success'):
+                    raise RuntimeError(response.text)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'logins': logins,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'logins_per_sec': round(logins / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        'password_pool': password_hasher.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--logins', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args.users, args.logins, args.concurrency)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+# load test for every endpoint of the user, task and admin routers, fully offline:
+# a throwaway sqlite database (or DATABASE_URL, e.g. a local postgres that may be
+# written to), local avatar storage instead of cloudinary and the stub geo resolver
+# instead of ip-api. Each scenario runs `--requests` requests from `--concurrency`
+# clients and reports p50/p95/p99 latency, throughput and db queries per request.
+#
+# usage: python benchmarks/routes.py [--requests 200] [--concurrency 20] [--tasks 500]
+#        [--slow-requests 40] [--only task] [--output results.json] [--compare old.json]
+#
+# results go to benchmarks/results/<commit>.json by default, pass an earlier file to
+# --compare to print the change per scenario. /task/events and /task/ws are
+# long-lived streams and are not part of the run.
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+PASSWORD = 'Bench@Passw0rd'
+WORDS = ['report', 'invoice', 'meeting', 'release', 'review', 'deploy', 'budget', 'design']
+
+
+def offline_environment(workdir, database_url):
+    # must run before anything imports config
+    os.environ['DATABASE_URL'] = database_url or f'sqlite:///{os.path.join(workdir, "bench.db")}'
+    os.environ['STORAGE_BACKEND'] = 'local'
+    os.environ['LOCAL_STORAGE_DIR'] = os.path.join(workdir, 'uploads')
+    os.environ['GEOIP_RESOLVER'] = 'stub'
+    os.environ['GEOIP_LOG_FILE'] = os.path.join(workdir, 'geo.log')
+    os.environ['SCHEMA_ON_STARTUP'] = 'upgrade'
+    os.environ.setdefault('SECRET_KEY', 'bench-secret')
+    # the limiters would turn most of the run into 429s
+    os.environ['LOGIN_IP_LIMIT'] = '1000000000'
+    os.environ['SIGNUP_IP_LIMIT'] = '1000000000'
+
+
+def avatar_bytes():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (256, 256), (40, 120, 200)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def percentile(latencies, q):
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method='inclusive')[q - 1]
+
+
+class QueryCounter:
+    def __init__(self, engines):
+        from sqlalchemy import event
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args):
+        self.count += 1
+
+
+async def fixtures(task_count, pool_size):
+    from datetime import timedelta
+    from database import Session
+    from tables.tasks import Tasks, utc_now
+    from tables.users import Users
+    from utils.passwords import password_hasher
+    from utils.tokens import issue_tokens
+
+    hashed = await password_hasher.hash(PASSWORD)
+    now = utc_now()
+
+    with Session() as db:
+        user = Users(username='bench', email='bench@example.com', full_name='bench', password=hashed)
+        admin = Users(username='admin', email='admin@example.com', full_name='admin', password=hashed, is_admin=True)
+        # accounts the delete scenarios use up, one per request
+        victims = [Users(username=f'victim{i}', email=f'victim{i}@example.com', full_name='victim', password=hashed)
+                   for i in range(pool_size)]
+        # one account per login, the per-email limiter allows 5 attempts in flight
+        logins = [Users(username=f'login{i}', email=f'login{i}@example.com', full_name='login', password=hashed)
+                  for i in range(pool_size)]
+        db.add_all([user, admin, *victims, *logins])
+        db.flush()
+
+        # deadlines spread from a week ago to a month ahead so every due window has rows
+        db.add_all([
+            Tasks(title=f'{WORDS[i % len(WORDS)]} {i}', description=f'{WORDS[(i * 3) % len(WORDS)]} notes {i}',
+                  deadline=now + timedelta(hours=i % (38 * 24) - 7 * 24), owner_id=user.id)
+            for i in range(task_count)
+        ])
+        # tasks the delete scenario removes
+        doomed = [Tasks(title=f'doomed {i}', description='bench', deadline=now, owner_id=user.id)
+                  for i in range(pool_size)]
+        db.add_all(doomed)
+        db.commit()
+
+        return {
+            'user': issue_tokens(user),
+            'admin': issue_tokens(admin),
+            'user_id': user.id,
+            'task_id': min(task.id for task in doomed) - 1,
+            'doomed': [task.id for task in doomed],
+            'victims': [issue_tokens(victim)['access_token'] for victim in victims],
+            'refresh': [issue_tokens(user)['refresh_token'] for _ in range(pool_size)],
+            'logout': [issue_tokens(user)['access_token'] for _ in range(pool_size)],
+        }
+
+
+def scenarios(data):
+    # name -> (slow, builder(i) -> (method, url, httpx kwargs))
+    # slow scenarios hash a password on every request and run --slow-requests times
+    def auth(token):
+        return {'Authorization': f'Bearer {token}'}
+
+    user, admin = auth(data['user']['access_token']), auth(data['admin']['access_token'])
+    avatar = avatar_bytes()
+    deadline = '2030-01-01T00:00:00'
+
+    return {
+        'user/sign-up': (True, lambda i: ('POST', '/api/v1/user/sign-up', {
+            'data': {'username': f'new{i}', 'email': f'new{i}@example.com', 'password': PASSWORD, 'full_name': 'new'},
+            'files': {'file': ('avatar.png', avatar, 'image/png')},
+        })),
+        'user/login': (True, lambda i: ('POST', '/api/v1/user/login', {
+            'data': {'email': f'login{i}@example.com', 'password': PASSWORD},
+        })),
+        'user/refresh': (False, lambda i: ('POST', '/api/v1/user/refresh', {
+            'data': {'refresh_token': data['refresh'][i]},
+        })),
+        'user/update': (False, lambda i: ('PATCH', '/api/v1/user/update', {
+            'data': {'full_name': f'bench {i}'}, 'headers': user,
+        })),
+        'user/logout': (False, lambda i: ('POST', '/api/v1/user/logout', {'headers': auth(data['logout'][i])})),
+        'user/soft-delete': (False, lambda i: ('DELETE', '/api/v1/user/soft-delete', {
+            'headers': auth(data['victims'][i]),
+        })),
+        'task/create': (False, lambda i: ('POST', '/api/v1/task/create', {
+            'data': {'title': f'created {i}', 'description': 'bench', 'deadline': deadline}, 'headers': user,
+        })),
+        'task/get-all-task': (False, lambda i: ('GET', '/api/v1/task/get-all-task', {'headers': user})),
+        'task/get-all-task?sort=deadline': (False, lambda i: ('GET', '/api/v1/task/get-all-task', {
+            'params': {'sort': 'deadline'}, 'headers': user,
+        })),
+        'task/due/overdue': (False, lambda i: ('GET', '/api/v1/task/due/overdue', {'headers': user})),
+        'task/due/soon': (False, lambda i: ('GET', '/api/v1/task/due/soon', {'params': {'hours': 72}, 'headers': user})),
+        'task/due/next': (False, lambda i: ('GET', '/api/v1/task/due/next', {'params': {'k': 10}, 'headers': user})),
+        'task/search': (False, lambda i: ('GET', '/api/v1/task/search', {
+            'params': {'q': WORDS[i % len(WORDS)][:4]}, 'headers': user,
+        })),
+        'task/changes': (False, lambda i: ('GET', '/api/v1/task/changes', {'headers': user})),
+        'task/patch': (False, lambda i: ('PATCH', f"/api/v1/task/{data['task_id']}", {
+            'json': {'title': f'patched {i}'}, 'headers': user,
+        })),
+        'task/batch': (False, lambda i: ('POST', '/api/v1/task/batch', {
+            'json': {'create': [{'title': f'batch {i} {n}', 'description': 'bench', 'deadline': deadline}
+                                for n in range(10)]},
+            'headers': user,
+        })),
+        'task/delete': (False, lambda i: ('DELETE', f"/api/v1/task/{data['doomed'][i]}", {'headers': user})),
+        'admin/tasks': (False, lambda i: ('GET', '/api/v1/admin/tasks', {'headers': admin})),
+        'admin/tasks/due': (False, lambda i: ('GET', '/api/v1/admin/tasks/due', {'headers': admin})),
+        'admin/tasks/export': (False, lambda i: ('GET', '/api/v1/admin/tasks/export', {'headers': admin})),
+        'admin/users': (False, lambda i: ('GET', '/api/v1/admin/users', {'headers': admin})),
+        'admin/db-pool': (False, lambda i: ('GET', '/api/v1/admin/db-pool', {'headers': admin})),
+        'admin/stats': (False, lambda i: ('GET', '/api/v1/admin/stats', {'headers': admin})),
+        'admin/stats/users': (False, lambda i: ('GET', '/api/v1/admin/stats/users', {'headers': admin})),
+        'admin/stats/deadlines': (False, lambda i: ('GET', '/api/v1/admin/stats/deadlines', {
+            'params': {'bucket': 'week'}, 'headers': admin,
+        })),
+    }
+
+
+def failed(response):
+    if response.status_code >= 400:
+        return True
+    # handlers answer 200 and carry their status in the body
+    if response.headers.get('content-type', '').startswith('application/json'):
+        return not response.json().get('success', True)
+    return False
+
+
+async def run_scenario(client, counter, builder, total, concurrency):
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < total:
+            index = next_index
+            next_index += 1
+            method, url, kwargs = builder(index)
+            # a spread of client addresses, so the geo pipeline sees realistic traffic
+            headers = {'x-forwarded-for': f'203.0.113.{index % 256}', **kwargs.pop('headers', {})}
+            started = time.perf_counter()
+            response = await client.request(method, url, headers=headers, **kwargs)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if failed(response):
+                errors += 1
+
+    queries = counter.count
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(total / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'queries_per_request': round((counter.count - queries) / total, 2),
+    }
+
+
+async def run(args, workdir):
+    offline_environment(workdir, args.database_url)
+    sys.path.insert(0, ROOT)
+
+    import httpx
+    import database
+    from config import settings
+    from main import app
+
+    pool_size = max(args.requests, args.slow_requests)
+    results = {}
+    async with app.router.lifespan_context(app):
+        data = await fixtures(args.tasks, pool_size)
+        if settings.admin_stats_source == 'summary':
+            # the /admin/stats scenarios should read the summary, not the live fallback
+            from utils.jobs import refresh_task_stats
+            await refresh_task_stats()
+        counter = QueryCounter([engine for engine in (database.engine, getattr(database.async_engine, 'sync_engine', None))
+                                if engine is not None])
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+            for name, (slow, builder) in scenarios(data).items():
+                if args.only and not re.search(args.only, name):
+                    continue
+                total = args.slow_requests if slow else args.requests
+                results[name] = await run_scenario(client, counter, builder, total, min(args.concurrency, total))
+                result = results[name]
+                print(f"{name:34} {result['requests_per_sec']:9.1f} req/s  p50 {result['p50_ms']:8.2f} ms  "
+                      f"p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+                      f"{result['queries_per_request']:6.2f} q/req  {result['errors']} errors")
+
+    return {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'config': {
+            'database': database.engine.dialect.name,
+            'db_mode': database.DB_MODE,
+            'db_profile': database.DB_PROFILE,
+            'bcrypt_rounds': settings.bcrypt_rounds,
+            'admin_stats_source': settings.admin_stats_source,
+            'requests': args.requests,
+            'slow_requests': args.slow_requests,
+            'concurrency': args.concurrency,
+            'tasks': args.tasks,
+            'python': sys.version.split()[0],
+        },
+        'results': results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(report, path):
+    with open(path) as f:
+        baseline = json.load(f)
+    print(f"\nagainst {baseline.get('commit')} ({path}):")
+    for name, result in report['results'].items():
+        old = baseline['results'].get(name)
+        if not old:
+            continue
+        changes = [f"{key} {(result[key] - old[key]) / old[key] * 100:+6.1f}%"
+                   for key in ('requests_per_sec', 'p50_ms', 'p95_ms', 'p99_ms') if old[key]]
+        print(f"{name:34} " + '  '.join(changes) +
+              f"  q/req {old['queries_per_request']} -> {result['queries_per_request']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--slow-requests', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--tasks', type=int, default=500)
+    parser.add_argument('--only', help='regex on scenario names, e.g. ^task/')
+    parser.add_argument('--database-url', help='defaults to a throwaway sqlite file')
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        report = asyncio.run(run(args, workdir))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nsaved {output}')
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# old vs new serialization of a task listing
+#
+# usage: DATABASE_URL=sqlite:// python benchmarks/serialization.py [--tasks 10000] [--repeat 20]
+#
+# old: dict -> jsonable_encoder -> JSONResponse (json.dumps), what FastAPI did for plain dicts
+# new: api_response -> ORJSONResponse, encoded by orjson without the jsonable_encoder pass
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from tables.tasks import Tasks
+    from utils.api_response import api_response, serialize_task
+
+    now = datetime.now()
+    tasks = [
+        Tasks(id=i, title=f'task {i}', description='x' * 100, deadline=now + timedelta(hours=i), owner_id=1)
+        for i in range(args.tasks)
+    ]
+
+    def old():
+        content = {'success': True, 'statuscode': 200, 'data': {'tasks': [serialize_task(task) for task in tasks]}}
+        return JSONResponse(jsonable_encoder(content)).body
+
+    def new():
+        return api_response(True, 200, {'tasks': [serialize_task(task) for task in tasks]}).body
+
+    old_seconds = best_of(args.repeat, old)
+    new_seconds = best_of(args.repeat, new)
+    print(f'{args.tasks} tasks, best of {args.repeat}')
+    print(f'  jsonable_encoder + json: {old_seconds * 1000:8.2f} ms')
+    print(f'  serialize_task + orjson: {new_seconds * 1000:8.2f} ms  ({old_seconds / new_seconds:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# time to first request of a fresh process (cold start)
+#
+# usage: DATABASE_URL=sqlite:///bench.db python benchmarks/startup.py [--runs 10] [--json results.json]
+#
+# each run spawns a new interpreter that imports main, runs the lifespan startup and
+# serves one request. compare e.g. SCHEMA_ON_STARTUP=upgrade against SCHEMA_ON_STARTUP=off
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def child():
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+
+    import httpx
+    from main import app
+    imported = time.perf_counter()
+
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            await client.get('/api/v1/task/get-all-task', headers={'Authorization': 'Bearer cold-start'})
+        served = time.perf_counter()
+
+    return {
+        'import_ms': (imported - started) * 1000,
+        'startup_ms': (ready - imported) * 1000,
+        'first_request_ms': (served - ready) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--json', help='also write the result to this file')
+    parser.add_argument('--child', action='store_true')
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(child())))
+        return
+
+    runs = []
+    for _ in range(args.runs):
+        spawned = time.perf_counter()
+        output = subprocess.run([sys.executable, __file__, '--child'], cwd=ROOT,
+                                capture_output=True, text=True, check=True)
+        run = json.loads(output.stdout.strip().splitlines()[-1])
+        run['process_ms'] = (time.perf_counter() - spawned) * 1000
+        runs.append(run)
+
+    result = {
+        'runs': args.runs,
+        'schema_on_startup': os.getenv('SCHEMA_ON_STARTUP', 'default'),
+        **{key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]},
+    }
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+# throughput of the task endpoints from 1 to N serve.py workers
+#
+# usage: python benchmarks/workers.py [--workers 1,2,4] [--seconds 5] [--concurrency 64]
+#        [--clients 4] [--tasks 2000] [--database-url postgresql://...] [--output results.json]
+#
+# builds a throwaway sqlite database (or uses DATABASE_URL, which gets written to),
+# then for every worker count starts `python serve.py --workers n` on a free port and
+# hammers each endpoint for --seconds from --clients load generator processes. The
+# listing cache is off so every request reaches the database, and the scheduler is
+# off so only requests use the cpu. sqlite serializes writers, run against postgres
+# for task/create numbers that mean something. Results go to
+# benchmarks/results/workers-<commit>.json by default.
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+WORDS = ['report', 'invoice', 'meeting', 'release', 'review', 'deploy', 'budget', 'design']
+
+
+def server_environment(workdir, database_url):
+    # what the parent (fixtures) and every server process run with
+    env = dict(os.environ)
+    env['DATABASE_URL'] = database_url or f'sqlite:///{os.path.join(workdir, "bench.db")}'
+    env['STORAGE_BACKEND'] = 'local'
+    env['LOCAL_STORAGE_DIR'] = os.path.join(workdir, 'uploads')
+    env['GEOIP_RESOLVER'] = 'stub'
+    env['GEOIP_LOG_FILE'] = os.path.join(workdir, 'geo.log')
+    env['SCHEMA_ON_STARTUP'] = 'off'
+    env['SCHEDULER'] = 'off'
+    env['TASK_LIST_CACHE'] = 'off'
+    env.setdefault('SECRET_KEY', 'bench-secret')
+    return env
+
+
+def fixtures(task_count):
+    # runs in the parent before any server starts
+    from datetime import timedelta
+    import migrations
+    from database import Session, engine
+    from tables.tasks import Tasks, utc_now
+    from tables.users import Users
+    from utils.tokens import issue_tokens
+
+    migrations.upgrade(engine)
+    now = utc_now()
+    with Session() as db:
+        user = Users(username='bench', email='bench@example.com', full_name='bench', password='-')
+        db.add(user)
+        db.flush()
+        db.add_all([
+            Tasks(title=f'{WORDS[i % len(WORDS)]} {i}', description=f'{WORDS[(i * 3) % len(WORDS)]} notes {i}',
+                  deadline=now + timedelta(hours=i % (38 * 24) - 7 * 24), owner_id=user.id)
+            for i in range(task_count)
+        ])
+        db.commit()
+        token = issue_tokens(user)['access_token']
+    engine.dispose()
+    return token
+
+
+def scenarios():
+    # name -> (method, url, request kwargs)
+    return {
+        'task/get-all-task': ('GET', '/api/v1/task/get-all-task', {}),
+        'task/due/soon': ('GET', '/api/v1/task/due/soon', {'params': {'hours': 72}}),
+        'task/search': ('GET', '/api/v1/task/search', {'params': {'q': 'repo'}}),
+        'task/changes': ('GET', '/api/v1/task/changes', {}),
+        'task/create': ('POST', '/api/v1/task/create', {
+            'data': {'title': 'created', 'description': 'bench', 'deadline': '2030-01-01T00:00:00'},
+        }),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, port, env):
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'serve.py'), '--workers', str(workers),
+                               '--host', '127.0.0.1', '--port', str(port)],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    import httpx
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'serve.py --workers {workers} exited with {server.returncode}')
+        try:
+            if httpx.get(f'http://127.0.0.1:{port}/metrics', timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f'serve.py --workers {workers} did not come up')
+
+
+def stop_server(server):
+    # SIGTERM, the same graceful drain a deployment gets
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+async def generate_load(base_url, token, scenario, seconds, concurrency):
+    import httpx
+    method, url, kwargs = scenario
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30,
+                                 headers={'Authorization': f'Bearer {token}'}) as client:
+        stop_at = time.monotonic() + seconds
+
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < stop_at:
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, url, **kwargs)
+                    # handlers answer 200 and carry their status in the body
+                    if response.status_code >= 400 or not response.json().get('success', True):
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, errors
+
+
+def client_process(args):
+    return asyncio.run(generate_load(*args))
+
+
+def measure(pool, clients, base_url, token, scenario, seconds, concurrency):
+    per_client = max(concurrency // clients, 1)
+    started = time.perf_counter()
+    outcomes = pool.map(client_process, [(base_url, token, scenario, seconds, per_client)] * clients)
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for client_latencies, _ in outcomes for latency in client_latencies)
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in outcomes),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(quantiles[49], 2),
+        'p99_ms': round(quantiles[98], 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def main():
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default=','.join(str(n) for n in sorted({1, 2, max(cores // 2, 1), cores})),
+                        help='comma separated worker counts')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--clients', type=int, default=max(cores // 2, 1), help='load generator processes')
+    parser.add_argument('--tasks', type=int, default=2000)
+    parser.add_argument('--database-url', help='defaults to a throwaway sqlite file')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    worker_counts = [int(n) for n in args.workers.split(',')]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = server_environment(workdir, args.database_url)
+        os.environ.update(env)
+        sys.path.insert(0, ROOT)
+        token = fixtures(args.tasks)
+
+        results = {}
+        with multiprocessing.get_context('spawn').Pool(args.clients) as pool:
+            for workers in worker_counts:
+                port = free_port()
+                server = start_server(workers, port, env)
+                try:
+                    for name, scenario in scenarios().items():
+                        result = measure(pool, args.clients, f'http://127.0.0.1:{port}', token, scenario,
+                                         args.seconds, args.concurrency)
+                        results.setdefault(name, {})[str(workers)] = result
+                        print(f"{name:20} {workers:3} workers {result['requests_per_sec']:9.1f} req/s  "
+                              f"p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+                              f"{result['errors']} errors")
+                finally:
+                    stop_server(server)
+
+    print(f"\nspeedup over {worker_counts[0]} worker(s):")
+    for name, by_workers in results.items():
+        base = by_workers[str(worker_counts[0])]['requests_per_sec'] or 1
+        print(f'{name:20} ' + '  '.join(f"{n}: {by_workers[str(n)]['requests_per_sec'] / base:4.2f}x"
+                                        for n in worker_counts))
+
+    report = {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'config': {
+            'database': env['DATABASE_URL'].split(':')[0],
+            'cores': cores,
+            'workers': worker_counts,
+            'seconds': args.seconds,
+            'concurrency': args.concurrency,
+            'clients': args.clients,
+            'tasks': args.tasks,
+            'python': sys.version.split()[0],
+        },
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"workers-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nsaved {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import os
+from functools import lru_cache
+from typing import Literal, Optional
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+
+class Settings(BaseModel):
+    # every field is read from the upper-case environment variable of the same name
+
+    # database.py
+    database_url: Optional[str] = None
+    db_mode: Literal['async', 'sync'] = 'async'
+    db_profile: Optional[Literal['server', 'serverless']] = None
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pgbouncer: bool = False
+    # DB_MODE=async keeps a sync engine next to the async one for migrations and the
+    # scheduler lock only, it gets this small pool instead of DB_POOL_SIZE / DB_MAX_OVERFLOW
+    db_sync_pool_size: int = 1
+    db_sync_max_overflow: int = 1
+    # total connections every worker together may hold on the primary, serve.py
+    # splits it into DB_POOL_SIZE / DB_MAX_OVERFLOW per worker when set
+    db_max_connections: Optional[int] = None
+    # read replicas, comma separated urls. Reads go to the primary while empty
+    database_replica_urls: Optional[str] = None
+    replica_sticky_seconds: int = 5
+    replica_sticky_backend: Literal['memory', 'redis'] = 'memory'
+    replica_retry_seconds: int = 30
+    # upgrade -> apply pending migrations on startup, check -> only warn when the
+    # schema is behind, off -> nothing (run `python -m migrations` at deploy time)
+    schema_on_startup: Optional[Literal['upgrade', 'check', 'off']] = None
+
+    # auth
+    secret_key: Optional[str] = None
+    algo: str = 'HS256'
+    access_token_minutes: int = 15
+    refresh_token_days: int = 30
+    token_revocation_backend: Literal['memory', 'redis'] = 'memory'
+    token_revocation_size: int = 100000
+    principal_cache: Literal['memory', 'redis', 'off'] = 'memory'
+    principal_cache_size: int = 10000
+    principal_cache_ttl: int = 60
+
+    # task listings
+    task_list_cache: Literal['memory', 'redis', 'off'] = 'memory'
+    task_list_cache_size: int = 1000
+    task_list_cache_ttl: int = 300
+    # deleted tasks stay visible to /task/changes this long, older sync cursors
+    # have to start over with a full sync
+    task_tombstone_days: int = 30
+    # push channel (/task/events, /task/ws)
+    task_events_backend: Literal['memory', 'redis'] = 'memory'
+    task_events_buffer: int = 100
+    task_events_ping: float = 15
+
+    # passwords
+    password_pool: Literal['thread', 'process'] = 'thread'
+    password_workers: int = os.cpu_count() or 1
+    password_max_concurrency: Optional[int] = None
+    bcrypt_rounds: int = 12
+
+    # rate limits
+    rate_limit_backend: Literal['memory', 'redis'] = 'memory'
+    rate_limit_max_keys: int = 100000
+    login_ip_limit: int = 60
+    signup_ip_limit: int = 10
+
+    redis_url: str = 'redis://localhost'
+
+    # geo ip enrichment
+    geoip_resolver: Literal['ip-api', 'stub', 'geoip2'] = 'ip-api'
+    geoip_database: str = 'GeoLite2-City.mmdb'
+    geoip_queue_size: int = 1000
+    geoip_cache_size: int = 10000
+    geoip_cache_ttl: int = 3600
+    geoip_workers: int = 4
+    geoip_log_file: str = 'log.txt'
+    geoip_log_batch: int = 100
+    geoip_log_interval: float = 1.0
+    # shutdown waits this long for queued lookups, stays well under SERVER_GRACEFUL_TIMEOUT
+    geoip_drain_timeout: float = 5
+
+    # avatar storage
+    storage_backend: Literal['cloudinary', 'local'] = 'cloudinary'
+    local_storage_dir: str = 'uploads'
+    local_storage_url: str = '/uploads'
+    avatar_max_bytes: int = 5 * 1024 * 1024
+    avatar_thumbnail_size: int = 128
+    cloudinary_cloud_name: Optional[str] = None
+    cloudinary_api_key: Optional[str] = None
+    cloudinary_api_secret: Optional[str] = None
+
+    # serve.py, WEB_CONCURRENCY defaults to the cores this process may run on
+    web_concurrency: Optional[int] = None
+    server_host: str = '0.0.0.0'
+    server_port: int = 8000
+    server_backlog: int = 2048
+    server_keep_alive: int = 5
+    # in flight requests get this long to finish on SIGTERM before they are cancelled
+    server_graceful_timeout: int = 30
+    # MetricsMiddleware already counts every request
+    server_access_log: bool = False
+
+    # set by the hosting platform
+    vercel: Optional[str] = None
+    aws_lambda_function_name: Optional[str] = None
+
+    # background jobs (utils/jobs.py), never started on serverless platforms
+    scheduler: Literal['on', 'off'] = 'on'
+    scheduler_tick: float = 10
+    job_chunk_size: int = 500
+    reminder_lead_minutes: int = 60
+    reminder_interval: int = 60
+    purge_deleted_users_days: int = 30
+    archive_after_days: int = 90
+    cleanup_interval: int = 3600
+    # /admin/stats: live -> aggregate on every request, summary -> read the task_stats
+    # tables the stats job rebuilds every STATS_REFRESH_INTERVAL seconds
+    admin_stats_source: Literal['live', 'summary'] = 'live'
+    stats_refresh_interval: int = 300
+
+    # instrumentation, /metrics asks for `Authorization: Bearer <METRICS_TOKEN>` when set
+    metrics_token: Optional[str] = None
+    slow_query_ms: Optional[float] = None
+    n_plus_one_threshold: Optional[int] = None
+
+    @property
+    def serverless(self):
+        return bool(self.vercel or self.aws_lambda_function_name)
+
+    @property
+    def engine_profile(self):
+        return self.db_profile or ('serverless' if self.serverless else 'server')
+
+    @property
+    def schema_startup_mode(self):
+        # cold starts should not pay for schema work, migrate at deploy time instead
+        return self.schema_on_startup or ('off' if self.engine_profile == 'serverless' else 'upgrade')
+
+    @property
+    def password_concurrency(self):
+        return self.password_max_concurrency or self.password_workers
+
+
+@lru_cache
+def get_settings() -> Settings:
+    # .env is read once here, nowhere else
+    load_dotenv()
+    values = {}
+    for name in Settings.model_fields:
+        value = os.environ.get(name.upper())
+        if value is not None and value != '':
+            values[name] = value
+    return Settings(**values)
+
+
+settings = get_settings()
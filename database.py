@@ -1,24 +1,408 @@
-from sqlalchemy import create_engine
+import hashlib
+import itertools
+from contextlib import asynccontextmanager
+from fastapi import Request
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker,declarative_base
-from dotenv import load_dotenv
-import os
+from sqlalchemy.pool import NullPool, QueuePool, AsyncAdaptedQueuePool
+from starlette.concurrency import run_in_threadpool
+from config import settings
+from utils.cache import create_cache
+from utils.metrics import instrument_engine
+import time
 
-load_dotenv()
+database_url = settings.database_url
 
-database_url = os.getenv('DATABASE_URL')
+# DB_MODE: 'async' (default) runs queries on an AsyncSession, 'sync' falls back to the
+# blocking Session executed in the threadpool
+DB_MODE = settings.db_mode
 
-engine = create_engine(database_url)
-Session = sessionmaker(bind=engine)
+# engine profile (DB_PROFILE):
+#   server     -> long running uvicorn, tuned QueuePool kept warm between requests
+#   serverless -> NullPool, nothing is held between invocations so cold instances don't
+#                 pile up idle connections. point DATABASE_URL at an external pooler
+#                 (pgbouncer / supabase pooler) and set DB_PGBOUNCER=1
+DB_PROFILE = settings.engine_profile
+
+# sync driver -> async driver used when DB_MODE=async
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'postgresql+psycopg': 'postgresql+psycopg_async',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+}
+
+
+def to_async_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+class PoolMetrics:
+    # checkouts, open connections and time spent waiting for a pooled connection
+
+    def __init__(self, name):
+        self.name = name
+        self.engine = None
+        self.checked_out = 0
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def attach(self, engine):
+        self.engine = engine
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+
+    def _on_connect(self, *args):
+        self.connects += 1
+
+    def _on_checkout(self, *args):
+        self.checked_out += 1
+        self.checkouts += 1
+
+    def _on_checkin(self, *args):
+        self.checked_out -= 1
+
+    def record_wait(self, seconds, timed_out=False):
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+        if timed_out:
+            self.timeouts += 1
+
+    def snapshot(self):
+        stats = {
+            'engine': self.name,
+            'profile': DB_PROFILE,
+            'pool': type(self.engine.pool).__name__ if self.engine else None,
+            'checked_out': self.checked_out,
+            'checkouts': self.checkouts,
+            'connects': self.connects,
+            'timeouts': self.timeouts,
+            'avg_wait_ms': round(self.wait_seconds / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            'max_wait_ms': round(self.max_wait_seconds * 1000, 3),
+        }
+        pool = self.engine.pool if self.engine else None
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), overflow=max(pool.overflow(), 0), idle=pool.checkedin())
+        return stats
+
+
+def timed_pool(base, metrics):
+    # pool class whose checkout reports how long it waited for a free connection
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = base._do_get(self)
+        except exc.TimeoutError:
+            metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        metrics.record_wait(time.perf_counter() - started)
+        return connection
+
+    return type(f'Timed{base.__name__}', (base,), {'_do_get': _do_get})
+
+
+def engine_options(url, metrics, is_async=False):
+    url = make_url(url)
+    # sqlite picks its own pool per file / memory database
+    if url.get_backend_name() == 'sqlite':
+        return {}
+
+    options = {}
+    if DB_PROFILE == 'serverless':
+        options['poolclass'] = NullPool
+    else:
+        # in async mode requests never touch the sync engine
+        side_engine = DB_MODE == 'async' and not is_async
+        options.update(
+            poolclass=timed_pool(AsyncAdaptedQueuePool if is_async else QueuePool, metrics),
+            pool_size=settings.db_sync_pool_size if side_engine else settings.db_pool_size,
+            max_overflow=settings.db_sync_max_overflow if side_engine else settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+            pool_pre_ping=True,
+        )
+
+    # transaction-mode pgbouncer can't keep server side prepared statements
+    if settings.db_pgbouncer and is_async and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'statement_cache_size': 0, 'prepared_statement_cache_size': 0}
+    return options
+
+
+pool_metrics = []
+
+
+def make_engine(url, name):
+    metrics = PoolMetrics(name)
+    sync_engine = create_engine(url, **engine_options(url, metrics))
+    metrics.attach(sync_engine)
+    instrument_engine(sync_engine)
+    pool_metrics.append(metrics)
+    return sync_engine
+
+
+def make_async_engine(url, name):
+    metrics = PoolMetrics(f'{name}-async')
+    async_url = to_async_url(url)
+    try:
+        engine = create_async_engine(async_url, **engine_options(async_url, metrics, is_async=True))
+    except ImportError as e:
+        raise RuntimeError(f'DB_MODE=async needs the {async_url.drivername} driver ({e}), '
+                           f'install it or set DB_MODE=sync') from e
+    metrics.attach(engine.sync_engine)
+    instrument_engine(engine.sync_engine)
+    pool_metrics.append(metrics)
+    return engine
+
+
+def pool_stats():
+    return [metrics.snapshot() for metrics in pool_metrics]
+
+
+engine = make_engine(database_url, 'primary')
+Session = sessionmaker(bind=engine, expire_on_commit=False)
 Base = declarative_base()
 
+async_engine = None
+AsyncSession = None
+
+if DB_MODE == 'async':
+    async_engine = make_async_engine(database_url, 'primary')
+    AsyncSession = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+
+class SyncSessionAdapter:
+    # exposes the AsyncSession methods the routers use on top of a sync Session,
+    # every blocking call is pushed to the threadpool so the event loop stays free
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    @property
+    def bind(self):
+        return self.sync_session.bind
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    def _execute_buffered(self, *args, **kwargs):
+        # fetch every row inside the worker thread, like AsyncSession does
+        result = self.sync_session.execute(*args, **kwargs)
+        if not getattr(result, 'returns_rows', True):
+            return result
+        try:
+            return result.freeze()()
+        except NotImplementedError:
+            # ORM bulk inserts come back as an IteratorResult without rows
+            return result
+
+    async def execute(self, *args, **kwargs):
+        return await run_in_threadpool(self._execute_buffered, *args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, *args, **kwargs)
+
+    async def scalars(self, *args, **kwargs):
+        return (await self.execute(*args, **kwargs)).scalars()
+
+    async def stream_scalars(self, *args, **kwargs):
+        result = await run_in_threadpool(self.sync_session.scalars, *args, **kwargs)
+        return SyncStreamResult(result)
+
+    async def get(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, *args, **kwargs)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def refresh(self, instance):
+        await run_in_threadpool(self.sync_session.refresh, instance)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def connection(self):
+        return await run_in_threadpool(self.sync_session.connection)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+class SyncStreamResult:
+    # server side cursor read one partition at a time in the threadpool
+
+    def __init__(self, result):
+        self.result = result
+
+    async def partitions(self, size=None):
+        iterator = self.result.partitions(size)
+        try:
+            while True:
+                partition = await run_in_threadpool(next, iterator, None)
+                if partition is None:
+                    break
+                yield partition
+        finally:
+            await run_in_threadpool(self.result.close)
+
+
+@asynccontextmanager
+async def db_session():
+    # session for code that lives outside a request (streams, background jobs)
+    if DB_MODE == 'async':
+        async with AsyncSession() as db:
+            yield db
+        return
+
+    db = SyncSessionAdapter(Session())
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+# read replicas (DATABASE_REPLICA_URLS, comma separated). Endpoints that only read take
+# get_read_db and are spread round robin over the replicas, everything else runs on the
+# primary. A replica that can't hand out a connection is skipped for
+# REPLICA_RETRY_SECONDS, its reads fall back to the primary meanwhile.
+# read-your-writes: after a write request (anything but GET / HEAD) the same bearer
+# token keeps reading from the primary for REPLICA_STICKY_SECONDS, long enough for the
+# replicas to catch up. REPLICA_STICKY_BACKEND=redis shares that between workers.
+# Replicas are never migrated, point them at copies of the primary (two sqlite files
+# work as stand-ins locally).
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class Replica:
+    def __init__(self, url, name):
+        self.name = name
+        self.down_until = 0.0
+        self.failures = 0
+        if DB_MODE == 'async':
+            self.engine = make_async_engine(url, name)
+            self.sessionmaker = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+        else:
+            self.engine = make_engine(url, name)
+            self.sessionmaker = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def session(self):
+        if DB_MODE == 'async':
+            return self.sessionmaker()
+        return SyncSessionAdapter(self.sessionmaker())
+
+    def mark_down(self, error):
+        self.failures += 1
+        self.down_until = time.monotonic() + settings.replica_retry_seconds
+        print(f'Replica {self.name} is unavailable, reading from the primary: {str(error)}')
+
+
+replicas = [
+    Replica(url.strip(), f'replica-{number}')
+    for number, url in enumerate(filter(str.strip, (settings.database_replica_urls or '').split(',')), 1)
+]
+replica_turn = itertools.count()
+recent_writes = create_cache(
+    settings.replica_sticky_backend,
+    prefix='wrote:',
+    maxsize=100000,
+    ttl=settings.replica_sticky_seconds,
+)
+
+
+def pick_replica():
+    healthy = [replica for replica in replicas if replica.healthy]
+    if not healthy:
+        return None
+    return healthy[next(replica_turn) % len(healthy)]
+
+
+def replica_stats():
+    return [
+        {'engine': replica.name, 'healthy': replica.healthy, 'failures': replica.failures}
+        for replica in replicas
+    ]
+
+
+def sticky_key(request):
+    authorization = request.headers.get('authorization')
+    if not authorization:
+        return None
+    return hashlib.blake2b(authorization.encode(), digest_size=16).hexdigest()
+
+
+@asynccontextmanager
+async def read_session(key=None):
+    # replica session, or the primary when there is none, none is healthy or the
+    # caller wrote something a moment ago
+    replica = None
+    if replicas and not (key and await recent_writes.get(key)):
+        replica = pick_replica()
+
+    if replica is not None:
+        db = replica.session()
+        try:
+            # check out the connection now so a dead replica is noticed here
+            await db.connection()
+        except Exception as e:
+            await db.close()
+            replica.mark_down(e)
+            replica = None
+
+    if replica is None:
+        async with db_session() as db:
+            yield db
+        return
 
-async def get_db():
-    db = Session()
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
 
+async def dispose_engines():
+    # last step of a graceful shutdown, pooled connections are closed instead of dropped
+    for replica in replicas:
+        if DB_MODE == 'async':
+            await replica.engine.dispose()
+        else:
+            await run_in_threadpool(replica.engine.dispose)
+    if async_engine is not None:
+        await async_engine.dispose()
+    await run_in_threadpool(engine.dispose)
 
 
+async def get_db(request: Request):
+    async with db_session() as db:
+        yield db
+    if replicas and request.method not in READ_METHODS:
+        key = sticky_key(request)
+        if key:
+            await recent_writes.set(key, 1)
 
+
+async def get_read_db(request: Request):
+    async with read_session(sticky_key(request)) as db:
+        yield db
@@ -1,52 +1,74 @@
+from contextlib import asynccontextmanager
+import os
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
-import httpx
-from database import  engine , Base
+from config import settings
+from database import  engine, dispose_engines
+from migrations import upgrade, status
+from utils.geoip import geo_pipeline, client_ip
+from utils.passwords import password_hasher
+from utils.jobs import scheduler
+from utils.events import task_events
+from utils.metrics import MetricsMiddleware, render_metrics
 
 
 from  routes import main
 
 
-Base.metadata.create_all(bind=engine)
-#
-# @asynccontextmanager
-# async def lifespan(app: FastAPI):
-#     r = redis.from_url("redis://localhost", encoding="utf-8", decode_responses=True)
-#     await FastAPILimiter.init(r)
-#     yield
-#     await r.close()
-# lifespan=lifespan
-app = FastAPI()
-
-@app.middleware("http")
-async def ip_logger(request: Request, call_next):
-    ip = request.headers.get("x-forwarded-for").split(",")[0].strip()
+def prepare_schema(mode):
+    # SCHEMA_ON_STARTUP: upgrade | check | off
+    if mode == 'upgrade':
+        applied = upgrade(engine)
+        if applied:
+            print(f'Applied migrations: {", ".join(applied)}')
+    elif mode == 'check':
+        pending = [version for version, _, done in status(engine) if not done]
+        if pending:
+            print(f'Schema is behind, pending migrations: {", ".join(pending)}')
 
 
-    if ip == "127.0.0.1":
-        geo_info = {"message": "Localhost IP - no geolocation lookup performed"}
-    else:
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"http://ip-api.com/json/{ip}")
-                geo_info = response.json()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(prepare_schema, settings.schema_startup_mode)
+    await geo_pipeline.start()
+    await task_events.start()
+    # serverless instances are frozen between requests, background jobs can't run there
+    if settings.scheduler == 'on' and not settings.serverless:
+        await scheduler.start()
+    yield
+    await scheduler.stop()
+    await task_events.stop()
+    await geo_pipeline.stop()
+    password_hasher.shutdown()
+    await dispose_engines()
 
-                with open('log.txt', 'a') as f:
-                    f.write('-' * 150 + '\n')
-                    f.write('IP: ' + ip + '\n')
-                    f.write(
-                        'Country: ' + geo_info["country"] +
-                        ', Region: ' + geo_info['regionName'] +
-                        ', City: ' + geo_info['city'] + '\n'
-                    )
-                    f.write('Latitude: ' + str(geo_info['lat']) + ', Longitude: ' + str(geo_info['lon']) + '\n')
 
-                    f.write('-' * 150 + '\n')  # Separator line
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
-        except Exception as e:
-            geo_info = {"error": str(e)}
+@app.middleware("http")
+async def ip_logger(request: Request, call_next):
+    # geo lookup and log write happen in the background pipeline
+    geo_pipeline.enqueue(client_ip(request))
 
     response = await call_next(request)
     return response
 
+# added last so it wraps everything else, ip_logger included
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics(request: Request):
+    # prometheus text format
+    if settings.metrics_token and request.headers.get('authorization') != f'Bearer {settings.metrics_token}':
+        return PlainTextResponse('Unauthorized', status_code=401)
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
+
 app.include_router(main.router)
+
+if settings.storage_backend == 'local':
+    os.makedirs(settings.local_storage_dir, exist_ok=True)
+    app.mount(settings.local_storage_url, StaticFiles(directory=settings.local_storage_dir), name='uploads')
@@ -0,0 +1,124 @@
+import importlib
+import os
+from datetime import datetime
+from sqlalchemy import inspect, text
+
+# in-repo schema migrations: every module in migrations/versions is one revision,
+# applied in filename order and recorded in the schema_migrations table.
+# a revision module defines `description` and `upgrade(conn)`.
+
+VERSIONS_DIR = os.path.join(os.path.dirname(__file__), 'versions')
+
+# key for pg_advisory_lock / name for GET_LOCK on mysql, so two workers never migrate
+# at the same time. Other dialects (sqlite) have a single writer anyway
+MIGRATION_LOCK_ID = 724501
+MIGRATION_LOCK_NAME = 'tasks-fastapi-migrations'
+
+
+def load_revisions():
+    revisions = []
+    for filename in sorted(os.listdir(VERSIONS_DIR)):
+        if filename.endswith('.py') and filename[0].isdigit():
+            name = filename[:-3]
+            revisions.append((name.split('_')[0], importlib.import_module(f'migrations.versions.{name}')))
+    return revisions
+
+
+def ensure_version_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version VARCHAR(20) PRIMARY KEY, description VARCHAR(200), applied_at TIMESTAMP)'
+    ))
+
+
+def applied_versions(conn):
+    ensure_version_table(conn)
+    return {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def lock(conn):
+    # blocks until the worker that got there first has finished
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('SELECT pg_advisory_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+    elif conn.dialect.name == 'mysql':
+        # -1 waits forever, like pg_advisory_lock
+        if conn.execute(text('SELECT GET_LOCK(:name, -1)'), {'name': MIGRATION_LOCK_NAME}).scalar() != 1:
+            raise RuntimeError('could not take the migration lock')
+    conn.commit()
+
+
+def unlock(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': MIGRATION_LOCK_ID})
+    elif conn.dialect.name == 'mysql':
+        conn.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': MIGRATION_LOCK_NAME})
+    conn.commit()
+
+
+def upgrade(engine):
+    applied = []
+    with engine.connect() as lock_conn:
+        lock(lock_conn)
+        try:
+            with engine.begin() as conn:
+                done = applied_versions(conn)
+
+            for version, module in load_revisions():
+                if version in done:
+                    continue
+                with engine.begin() as conn:
+                    module.upgrade(conn)
+                    conn.execute(
+                        text('INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)'),
+                        {'v': version, 'd': module.description, 't': datetime.now()},
+                    )
+                applied.append(version)
+        finally:
+            unlock(lock_conn)
+    return applied
+
+
+def status(engine):
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    return [(version, module.description, version in done) for version, module in load_revisions()]
+
+
+# helpers used by revisions, all of them are no-ops when the object already exists
+# so a database first built by create_all can still be brought under migrations
+
+def has_index(conn, table, name):
+    return any(index['name'] == name for index in inspect(conn).get_indexes(table))
+
+
+def has_column(conn, table, name):
+    return any(column['name'] == name for column in inspect(conn).get_columns(table))
+
+
+def add_column(conn, table, name, type_):
+    # type_ is a sqlalchemy type, compiled for this dialect so the column matches what
+    # the model declares (DateTime is DATETIME on mysql, not its TIMESTAMP)
+    if has_column(conn, table, name):
+        return False
+    conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {type_.compile(dialect=conn.dialect)}'))
+    return True
+
+
+def create_index(conn, name, table, columns, where=None, using=None):
+    if has_index(conn, table, name):
+        return
+    method = f' USING {using}' if using and conn.dialect.name == 'postgresql' else ''
+    sql = f'CREATE INDEX {name} ON {table}{method} ({", ".join(columns)})'
+    # partial indexes exist on postgres and sqlite, elsewhere fall back to a full index
+    if where is not None and conn.dialect.name in ('postgresql', 'sqlite'):
+        sql += f' WHERE {where}'
+    conn.execute(text(sql))
+
+
+def drop_index(conn, name, table):
+    if not has_index(conn, table, name):
+        return
+    if conn.dialect.name == 'mysql':
+        conn.execute(text(f'DROP INDEX {name} ON {table}'))
+    else:
+        conn.execute(text(f'DROP INDEX {name}'))
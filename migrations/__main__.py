@@ -0,0 +1,29 @@
+import sys
+from database import engine
+from migrations import upgrade, status
+from migrations.check import check_indexes
+
+# usage: python -m migrations [upgrade | status | check]
+
+
+def main(command='upgrade'):
+    if command == 'upgrade':
+        applied = upgrade(engine)
+        print(f'applied: {", ".join(applied)}' if applied else 'schema is up to date')
+    elif command == 'status':
+        for version, description, done in status(engine):
+            print(f'{version}  {"applied" if done else "pending"}  {description}')
+    elif command == 'check':
+        failures = check_indexes(engine)
+        for failure in failures:
+            print(f'FAIL {failure}')
+        if failures:
+            sys.exit(1)
+        print('hot queries use their indexes')
+    else:
+        print(f'unknown command: {command}')
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,61 @@
+import json
+import re
+from sqlalchemy import select, false, text, tuple_
+from tables.tasks import Tasks
+from tables.users import Users
+
+# hot queries and the index each one has to use, checked with EXPLAIN
+
+
+def hot_queries():
+    return [
+        ('tasks by owner', 'ix_tasks_owner_id_id',
+         select(Tasks).where(Tasks.owner_id == 1).order_by(Tasks.id).limit(101)),
+        ('tasks by owner and deadline', 'ix_tasks_owner_id_deadline',
+         select(Tasks).where(Tasks.owner_id == 1, Tasks.deadline.is_not(None))
+         .order_by(Tasks.deadline, Tasks.id).limit(101)),
+        ('tasks by deadline', 'ix_tasks_deadline_id',
+         select(Tasks).where(Tasks.deadline.is_not(None)).order_by(Tasks.deadline, Tasks.id).limit(101)),
+        ('task changes', 'ix_tasks_owner_id_version',
+         select(Tasks).where(Tasks.owner_id == 1, tuple_(Tasks.version, Tasks.id) > (0, 0))
+         .order_by(Tasks.version, Tasks.id).limit(101)),
+        ('active users', 'ix_users_active',
+         select(Users.id).where(Users.is_deleted == false())),
+    ]
+
+
+def plan_indexes(conn, sql):
+    dialect = conn.dialect.name
+
+    if dialect == 'postgresql':
+        # tiny test tables would otherwise be sequentially scanned whatever the indexes
+        conn.execute(text('SET LOCAL enable_seqscan = off'))
+        plan = conn.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        names = set()
+        nodes = [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            if 'Index Name' in node:
+                names.add(node['Index Name'])
+            nodes.extend(node.get('Plans', []))
+        return names
+
+    if dialect == 'sqlite':
+        rows = conn.execute(text(f'EXPLAIN QUERY PLAN {sql}')).all()
+        return {name for row in rows for name in re.findall(r'USING (?:COVERING )?INDEX (\w+)', row[-1])}
+
+    rows = conn.execute(text(f'EXPLAIN {sql}')).mappings().all()
+    return {row['key'] for row in rows if row.get('key')}
+
+
+def check_indexes(engine):
+    failures = []
+    with engine.begin() as conn:
+        for name, index, stmt in hot_queries():
+            sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+            used = plan_indexes(conn, sql)
+            if index not in used:
+                failures.append(f'{name}: expected {index}, plan used {sorted(used) or "no index"}')
+    return failures
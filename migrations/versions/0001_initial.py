@@ -0,0 +1,23 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, Date
+from database import Base
+
+description = 'initial schema (users, tasks, rate_limit)'
+
+# the rate_limit model is gone (dropped in 0011), its original definition lives on here
+rate_limit = Table(
+    'rate_limit', MetaData(),
+    Column('id', Integer, primary_key=True, index=True, autoincrement=True),
+    Column('email', String(50), nullable=False, unique=True),
+    Column('last_attempt', Date),
+    Column('attempt', Integer),
+)
+
+
+def upgrade(conn):
+    import tables.users, tables.tasks  # noqa: F401  register the models
+
+    Base.metadata.create_all(bind=conn, tables=[
+        Base.metadata.tables['users'],
+        Base.metadata.tables['tasks'],
+    ])
+    rate_limit.create(bind=conn, checkfirst=True)
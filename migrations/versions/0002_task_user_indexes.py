@@ -0,0 +1,18 @@
+from migrations import create_index
+
+description = 'indexes for the per-user task listings and active users'
+
+
+def upgrade(conn):
+    # /task/get-all-task: owner_id = ? ORDER BY id
+    create_index(conn, 'ix_tasks_owner_id_id', 'tasks', ['owner_id', 'id'])
+    # owner_id = ? ORDER BY deadline, upcoming / overdue tasks of one user
+    create_index(conn, 'ix_tasks_owner_id_deadline', 'tasks', ['owner_id', 'deadline', 'id'])
+    # admin listings ordered by deadline across every owner
+    create_index(conn, 'ix_tasks_deadline_id', 'tasks', ['deadline', 'id'])
+    # accounts that are not soft deleted
+    create_index(conn, 'ix_users_active', 'users', ['id'], where='is_deleted = ' + active_literal(conn))
+
+
+def active_literal(conn):
+    return 'false' if conn.dialect.name == 'postgresql' else '0'
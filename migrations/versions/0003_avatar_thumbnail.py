@@ -0,0 +1,9 @@
+from sqlalchemy import text
+from migrations import has_column
+
+description = 'users.avatar_thumbnail_url'
+
+
+def upgrade(conn):
+    if not has_column(conn, 'users', 'avatar_thumbnail_url'):
+        conn.execute(text('ALTER TABLE users ADD COLUMN avatar_thumbnail_url VARCHAR(250)'))
@@ -0,0 +1,38 @@
+from sqlalchemy import text
+from migrations import create_index, has_column
+
+description = 'full-text search over task title/description'
+
+
+def upgrade(conn):
+    if conn.dialect.name == 'postgresql':
+        # kept up to date by postgres itself, 'simple' so prefix matching sees the raw words
+        if not has_column(conn, 'tasks', 'search_vector'):
+            conn.execute(text(
+                "ALTER TABLE tasks ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+                "(to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))) STORED"
+            ))
+        create_index(conn, 'ix_tasks_search_vector', 'tasks', ['search_vector'], using='gin')
+
+    elif conn.dialect.name == 'sqlite':
+        # external content fts5 table, the triggers mirror every write on tasks
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+            "title, description, content='tasks', content_rowid='id')"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+            "INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+            "INSERT INTO tasks_fts(tasks_fts, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE ON tasks BEGIN "
+            "INSERT INTO tasks_fts(tasks_fts, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); "
+            "INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+        ))
+        conn.execute(text("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')"))
@@ -0,0 +1,19 @@
+from sqlalchemy import DateTime, text
+from database import Base
+from migrations import add_column, create_index, has_column
+
+description = 'tasks.created_at/updated_at/version and task_tombstones for delta sync'
+
+
+def upgrade(conn):
+    import tables.task_tombstones  # noqa: F401  register the model
+
+    # existing rows keep NULL timestamps and version 0, the first sync returns them anyway
+    add_column(conn, 'tasks', 'created_at', DateTime())
+    add_column(conn, 'tasks', 'updated_at', DateTime())
+    if not has_column(conn, 'tasks', 'version'):
+        conn.execute(text('ALTER TABLE tasks ADD COLUMN version INTEGER NOT NULL DEFAULT 0'))
+    # /task/changes: owner_id = ? AND (version, id) > (?, ?) ORDER BY version, id
+    create_index(conn, 'ix_tasks_owner_id_version', 'tasks', ['owner_id', 'version', 'id'])
+
+    Base.metadata.tables['task_tombstones'].create(bind=conn, checkfirst=True)
@@ -0,0 +1,9 @@
+from sqlalchemy import text
+from migrations import has_column
+
+description = 'users.token_version'
+
+
+def upgrade(conn):
+    if not has_column(conn, 'users', 'token_version'):
+        conn.execute(text('ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0'))
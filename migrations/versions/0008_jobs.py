@@ -0,0 +1,14 @@
+from sqlalchemy import DateTime, text
+from migrations import add_column
+from tables.tasks import utc_now
+
+description = 'tasks.reminder_sent_at and users.deleted_at for the background jobs'
+
+
+def upgrade(conn):
+    add_column(conn, 'tasks', 'reminder_sent_at', DateTime())
+    if add_column(conn, 'users', 'deleted_at', DateTime()):
+        # accounts deleted before this revision start their retention period now. Bound
+        # naive utc, CURRENT_TIMESTAMP would be in the server's time zone on mysql
+        conn.execute(text('UPDATE users SET deleted_at = :now WHERE is_deleted = :deleted'),
+                     {'now': utc_now(), 'deleted': True})
@@ -0,0 +1,9 @@
+from database import Base
+
+description = 'tasks_archive for tasks long past their deadline'
+
+
+def upgrade(conn):
+    import tables.tasks_archive  # noqa: F401  register the model
+
+    Base.metadata.tables['tasks_archive'].create(bind=conn, checkfirst=True)
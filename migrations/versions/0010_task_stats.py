@@ -0,0 +1,11 @@
+from database import Base
+
+description = 'task_stats and task_deadline_stats summaries for /admin/stats'
+
+
+def upgrade(conn):
+    import tables.task_stats  # noqa: F401  register the models
+    import tables.task_deadline_stats  # noqa: F401
+
+    Base.metadata.tables['task_stats'].create(bind=conn, checkfirst=True)
+    Base.metadata.tables['task_deadline_stats'].create(bind=conn, checkfirst=True)
@@ -0,0 +1,7 @@
+from sqlalchemy import text
+
+description = 'drop rate_limit, unused since the token-bucket limiter'
+
+
+def upgrade(conn):
+    conn.execute(text('DROP TABLE IF EXISTS rate_limit'))
@@ -0,0 +1,20 @@
+from typing import List
+from pydantic import BaseModel
+from models.datetimes import UtcDateTime
+from models.PatchTaskModel import PatchTaskModel
+
+
+class CreateTaskItem(BaseModel):
+    title: str
+    description: str
+    deadline: UtcDateTime
+
+
+class PatchTaskItem(PatchTaskModel):
+    id: int
+
+
+class BatchTaskModel(BaseModel):
+    create: List[CreateTaskItem] = []
+    update: List[PatchTaskItem] = []
+    delete: List[int] = []
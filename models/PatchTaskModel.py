@@ -1,9 +1,9 @@
-from datetime import datetime
 from typing import Optional
 from pydantic import BaseModel
+from models.datetimes import UtcDateTime
 
 
 class PatchTaskModel(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
-    deadline: Optional[datetime] = None
+    deadline: Optional[UtcDateTime] = None
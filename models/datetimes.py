@@ -0,0 +1,7 @@
+from datetime import datetime
+from typing import Annotated
+from pydantic import AfterValidator
+from tables.tasks import naive_utc
+
+# every datetime a client sends, stored and compared as naive utc
+UtcDateTime = Annotated[datetime, AfterValidator(naive_utc)]
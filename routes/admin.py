@@ -1,42 +1,255 @@
-from typing import Annotated
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from database import get_db
+import json
+from typing import Annotated, Literal
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_read_db, read_session, pool_stats, replica_stats
+from models.datetimes import UtcDateTime
 from routes.user import get_current_user
 from tables.tasks import Tasks
+from tables.tasks_archive import TasksArchive
 from tables.users import Users
-from utils.api_response import api_response
+from utils.api_response import api_response, serialize_task, serialize_admin_user
+from utils.pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, due_window, encode_cursor,
+                              filter_deadline, json_default, merge_pages, task_keyset, task_page)
+from utils.stats import deadline_histogram, owner_counts, task_totals, user_totals
 
 router = APIRouter(
     prefix='/admin',
     tags=['admin']
 )
 
-db_dependency = Annotated[Session, Depends(get_db)]
-user_dependency = Annotated[Session, Depends(get_current_user)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
+user_dependency = Annotated[dict, Depends(get_current_user)]
+
+# rows fetched per round trip by the streaming export
+EXPORT_CHUNK_SIZE = 1000
 
 
 @router.get("/tasks")
-async def get_all_tasks(user: user_dependency, db: db_dependency):
+async def get_all_tasks(
+        user: user_dependency,
+        db: read_db_dependency,
+        owner_id: int | None = None,
+        sort: Literal['owner', 'deadline'] = 'owner',
+        cursor: str | None = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        deadline_from: UtcDateTime | None = None,
+        deadline_to: UtcDateTime | None = None,
+        include_archived: bool = False,
+):
+    try:
+        if user.get('role') != 'admin':
+            return api_response(False, 401, 'Invalid Credentials')
+
+        pages = []
+        for model in (Tasks, TasksArchive) if include_archived else (Tasks,):
+            stmt = filter_deadline(select(model), deadline_from, deadline_to, model)
+            if owner_id is not None:
+                stmt = stmt.where(model.owner_id == owner_id)
+            pages.append((await db.scalars(task_keyset(stmt, sort, cursor, limit, model))).all())
+        tasks, next_cursor = task_page(merge_pages(pages, sort), sort, limit)
+
+        return api_response(True, 200, {
+            'tasks': [serialize_task(task) for task in tasks],
+            'next_cursor': next_cursor
+        })
+
+    except ValueError as e:
+        return api_response(False, 400, str(e))
+    except Exception as e:
+        return api_response(False, 500, f"An error occurred: {str(e)}")
+
+
+@router.get("/tasks/due")
+async def get_due_tasks(
+        user: user_dependency,
+        db: read_db_dependency,
+        window: Literal['overdue', 'soon', 'next'] = 'overdue',
+        hours: int = Query(24, ge=1, le=24 * 365),
+        cursor: str | None = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    try:
+        if not user:
+            return api_response(False, 401, 'Not authorized')
+
+        if user.get('role') != 'admin':
+            return api_response(False, 401, 'Invalid Credentials')
+
+        # range scan on the (deadline, id) index, never the whole table
+        deadline_from, deadline_to = due_window(window, hours)
+        stmt = filter_deadline(select(Tasks), deadline_from, deadline_to)
+        tasks, next_cursor = task_page(
+            (await db.scalars(task_keyset(stmt, 'deadline', cursor, limit))).all(), 'deadline', limit
+        )
+
+        return api_response(True, 200, {
+            'tasks': [serialize_task(task) for task in tasks],
+            'next_cursor': next_cursor
+        })
+
+    except ValueError as e:
+        return api_response(False, 400, str(e))
+    except Exception as e:
+        return api_response(False, 500, f"An error occurred: {str(e)}")
+
+
+async def stream_tasks(stmt, fmt):
+    # own session, the request session is closed before a streamed body is sent
+    async with read_session() as db:
+        result = await db.stream_scalars(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+
+        if fmt == 'json':
+            yield '['
+        first = True
+        async for partition in result.partitions():
+            rows = [json.dumps(serialize_task(task), default=json_default) for task in partition]
+            if fmt == 'json':
+                yield ('' if first else ',') + ','.join(rows)
+            else:
+                yield '\n'.join(rows) + '\n'
+            first = False
+        if fmt == 'json':
+            yield ']'
+
+
+@router.get("/tasks/export")
+async def export_tasks(
+        user: user_dependency,
+        format: Literal['ndjson', 'json'] = 'ndjson',
+        owner_id: int | None = None,
+        deadline_from: UtcDateTime | None = None,
+        deadline_to: UtcDateTime | None = None,
+):
     try:
+        if not user:
+            return api_response(False, 401, 'Not authorized')
+
         if user.get('role') != 'admin':
             return api_response(False, 401, 'Invalid Credentials')
 
-        tasks = db.query(Tasks).all()
-        return tasks
+        stmt = filter_deadline(select(Tasks), deadline_from, deadline_to).order_by(Tasks.id)
+        if owner_id is not None:
+            stmt = stmt.where(Tasks.owner_id == owner_id)
+
+        media_type = 'application/x-ndjson' if format == 'ndjson' else 'application/json'
+        return StreamingResponse(stream_tasks(stmt, format), media_type=media_type)
 
     except Exception as e:
         return api_response(False, 500, f"An error occurred: {str(e)}")
 
 
 @router.get('/users')
-async def get_all_users(user: user_dependency, db: db_dependency):
+async def get_all_users(user: user_dependency, db: read_db_dependency):
+    try:
+        if user.get('role') != 'admin':
+            return api_response(False, 401, 'Invalid Credentials')
+
+        users = (await db.scalars(select(Users))).all()
+        return api_response(True, 200, {
+            'users': [serialize_admin_user(user) for user in users]
+        })
+
+    except Exception as e:
+        return api_response(False, 500, f"An error occurred: {str(e)}")
+
+
+@router.get('/stats')
+async def get_stats(user: user_dependency, db: read_db_dependency):
+    try:
+        if not user:
+            return api_response(False, 401, 'Not authorized')
+
+        if user.get('role') != 'admin':
+            return api_response(False, 401, 'Invalid Credentials')
+
+        tasks, refreshed_at = await task_totals(db)
+        return api_response(True, 200, {
+            'users': await user_totals(db),
+            'tasks': tasks,
+            'refreshed_at': refreshed_at,
+        })
+
+    except Exception as e:
+        return api_response(False, 500, f"An error occurred: {str(e)}")
+
+
+@router.get('/stats/users')
+async def get_user_stats(
+        user: user_dependency,
+        db: read_db_dependency,
+        cursor: str | None = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    # task counts per user, one page of users at a time ordered by id
+    try:
+        if not user:
+            return api_response(False, 401, 'Not authorized')
+
+        if user.get('role') != 'admin':
+            return api_response(False, 401, 'Invalid Credentials')
+
+        stmt = select(Users).order_by(Users.id).limit(limit + 1)
+        if cursor:
+            (after,) = decode_cursor(cursor)
+            stmt = stmt.where(Users.id > int(after))
+        users = (await db.scalars(stmt)).all()
+        next_cursor = encode_cursor(users[limit - 1].id) if len(users) > limit else None
+        users = users[:limit]
+
+        counts, refreshed_at = await owner_counts(db, [user.id for user in users])
+        return api_response(True, 200, {
+            'users': [{'user_id': user.id, 'username': user.username, 'is_deleted': bool(user.is_deleted),
+                       **counts[user.id]} for user in users],
+            'next_cursor': next_cursor,
+            'refreshed_at': refreshed_at,
+        })
+
+    except ValueError as e:
+        return api_response(False, 400, str(e))
+    except Exception as e:
+        return api_response(False, 500, f"An error occurred: {str(e)}")
+
+
+@router.get('/stats/deadlines')
+async def get_deadline_stats(
+        user: user_dependency,
+        db: read_db_dependency,
+        bucket: Literal['day', 'week', 'month'] = 'day',
+        deadline_from: UtcDateTime | None = None,
+        deadline_to: UtcDateTime | None = None,
+):
+    # deadline histogram over tasks and tasks_archive
     try:
+        if not user:
+            return api_response(False, 401, 'Not authorized')
+
+        if user.get('role') != 'admin':
+            return api_response(False, 401, 'Invalid Credentials')
+
+        buckets, refreshed_at = await deadline_histogram(db, bucket, deadline_from, deadline_to)
+        return api_response(True, 200, {
+            'bucket': bucket,
+            'buckets': buckets,
+            'refreshed_at': refreshed_at,
+        })
+
+    except Exception as e:
+        return api_response(False, 500, f"An error occurred: {str(e)}")
+
+
+@router.get('/db-pool')
+async def get_pool_stats(user: user_dependency):
+    try:
+        if not user:
+            return api_response(False, 401, 'Not authorized')
+
         if user.get('role') != 'admin':
             return api_response(False, 401, 'Invalid Credentials')
 
-        users = db.query(Users).all()
-        return users
+        return api_response(True, 200, {'engines': pool_stats(), 'replicas': replica_stats()})
 
     except Exception as e:
         return api_response(False, 500, f"An error occurred: {str(e)}")
@@ -1,34 +1,50 @@
-from datetime import datetime
-from typing import Annotated
-from fastapi import APIRouter, Depends, Form
-from sqlalchemy.orm import Session
-from database import get_db
+from collections import defaultdict
+from typing import Annotated, Literal
+from fastapi import APIRouter, Depends, Form, Header, Query, WebSocket
+from fastapi.responses import StreamingResponse
+from jose import JWTError
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, get_read_db, db_session
+from models.BatchTaskModel import BatchTaskModel
 from models.PatchTaskModel import PatchTaskModel
+from models.datetimes import UtcDateTime
 from routes.user import get_current_user
 from tables.tasks import Tasks
-from tables.users import Users
+from tables.tasks_archive import TasksArchive
+from tables.task_tombstones import TaskTombstones
 from utils.api_response import api_response, serialize_task
+from utils.events import StreamAccess, task_events, sse_stream, websocket_stream
+from utils.tokens import ACCESS, decode_token, is_revoked
+from utils.sync import CursorExpired, task_changes, tombstone_rows, upsert_change, delete_change
+from utils.search import search_terms, task_search, search_page
+from utils.task_version import (bump_task_version, get_task_version, listing_cache, listing_key, listing_etag,
+                                etag_matches, not_modified, cached_listing, store_listing)
+from utils.pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, due_window, filter_deadline, merge_pages, task_keyset,
+                              task_page)
 
 user_dependency = Annotated[dict, Depends(get_current_user)]
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
 
 router = APIRouter(
     prefix='/task',
     tags=['Task']
 )
 
-async def check_account_status(user_id, db):
-    try:
-        user = db.query(Users).filter(Users.id == user_id).first()
-        if not user or user.is_deleted:
-            return True
-        return False
-    except Exception as e:
-        return api_response(False, 500, f"An error occurred while checking account status: {str(e)}")
+# upper bound on create + update + delete items in one /task/batch request
+MAX_BATCH_SIZE = 500
+
+ARCHIVED_READ_ONLY = 'Archived tasks are read only'
+
+async def check_account_status(user):
+    # the principal from get_current_user already carries is_deleted, so this
+    # no longer loads the same user row a second time
+    return not user.get('user_id') or user.get('is_deleted', False)
 
 
 @router.post('/create')
-async def task_create(user: user_dependency, db: db_dependency, title: str = Form(...), description: str = Form(...), deadline: datetime = Form(...)):
+async def task_create(user: user_dependency, db: db_dependency, title: Annotated[str, Form()], description: Annotated[str, Form()], deadline: Annotated[UtcDateTime, Form()]):
     try:
         if not user:
             return api_response(False, 401, "Invalid Authorization header")
@@ -39,47 +55,270 @@ async def task_create(user: user_dependency, db: db_dependency, title: str = For
             deadline=deadline,
             owner_id=user.get('user_id')
         )
+        task.version = (await bump_task_version(db, task.owner_id)).get(task.owner_id, 0)
         db.add(task)
-        db.commit()
-        db.refresh(task)
+        await db.commit()
+        await db.refresh(task)
+        await task_events.publish(task.owner_id, [upsert_change(task)])
 
-        return api_response(True, 201, task)
+        return api_response(True, 201, serialize_task(task))
 
     except Exception as e:
         return api_response(False, 500, f"An error occurred while creating task: {str(e)}")
 
 
 @router.get('/get-all-task')
-async def get_task(user: user_dependency, db: db_dependency, user_id: int | None = None):
+async def get_task(
+        user: user_dependency,
+        db: read_db_dependency,
+        user_id: int | None = None,
+        sort: Literal['id', 'deadline'] = 'id',
+        cursor: str | None = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        deadline_from: UtcDateTime | None = None,
+        deadline_to: UtcDateTime | None = None,
+        include_archived: bool = False,
+        if_none_match: str | None = Header(None),
+):
     try:
 
         if not user:
             return api_response(False, 401, "Invalid Authorization header")
 
 
-        if await check_account_status(user.get("user_id"), db):
+        if await check_account_status(user):
             return api_response(False, 404, "User not found")
 
 
         if user_id is not None:
             if user.get("role") != "admin":
                 return api_response(False, 403, "Forbidden: Admin access required")
-            tasks = db.query(Tasks).filter(Tasks.owner_id == user_id).all()
+            owner_id = user_id
         else:
+            owner_id = user.get('user_id')
+
+        # the version is read before the tasks, so a listing is never older than the
+        # version it gets stored under
+        version = await get_task_version(db, owner_id)
+        key = None
+        if version is not None:
+            key = listing_key(owner_id, version, sort, cursor, limit, deadline_from, deadline_to, include_archived)
+            etag = listing_etag(key)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+            body = await listing_cache.get(key)
+            if body is not None:
+                return cached_listing(body, etag)
+
+        # the archive is a second keyset query on its own (owner_id, ...) indexes
+        pages = []
+        for model in (Tasks, TasksArchive) if include_archived else (Tasks,):
+            stmt = filter_deadline(select(model).where(model.owner_id == owner_id), deadline_from, deadline_to, model)
+            pages.append((await db.scalars(task_keyset(stmt, sort, cursor, limit, model))).all())
+        tasks, next_cursor = task_page(merge_pages(pages, sort), sort, limit)
+
+        if not tasks and cursor is None:
+            return api_response(False, 404, "No tasks found")
 
-            tasks = db.query(Tasks).filter(Tasks.owner_id == user.get('user_id')).all()
+        response = api_response(True, 200, {
+            "tasks": [serialize_task(task) for task in tasks],
+            "next_cursor": next_cursor
+        })
+        if key is not None:
+            await store_listing(key, etag, response)
+        return response
+
+    except ValueError as e:
+        return api_response(False, 400, str(e))
+    except Exception as e:
+        return api_response(False, 500, f"An error occurred while retrieving tasks: {str(e)}")
 
-        if not tasks:
-            return api_response(False, 404, "No tasks found")
+
+async def due_tasks(user, db, window, hours, cursor, limit):
+    try:
+        if not user:
+            return api_response(False, 401, "Invalid Authorization header")
+
+        if await check_account_status(user):
+            return api_response(False, 404, "User not found")
+
+        # range scan on (owner_id, deadline, id), keyset ordered by (deadline, id)
+        deadline_from, deadline_to = due_window(window, hours)
+        stmt = filter_deadline(select(Tasks).where(Tasks.owner_id == user.get('user_id')), deadline_from, deadline_to)
+        tasks, next_cursor = task_page(
+            (await db.scalars(task_keyset(stmt, 'deadline', cursor, limit))).all(), 'deadline', limit
+        )
 
         return api_response(True, 200, {
-            "tasks": [serialize_task(task) for task in tasks]
+            "tasks": [serialize_task(task) for task in tasks],
+            "next_cursor": next_cursor
         })
 
+    except ValueError as e:
+        return api_response(False, 400, str(e))
     except Exception as e:
         return api_response(False, 500, f"An error occurred while retrieving tasks: {str(e)}")
 
 
+@router.get('/due/overdue')
+async def overdue_tasks(
+        user: user_dependency,
+        db: read_db_dependency,
+        cursor: str | None = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    return await due_tasks(user, db, 'overdue', None, cursor, limit)
+
+
+@router.get('/due/soon')
+async def tasks_due_soon(
+        user: user_dependency,
+        db: read_db_dependency,
+        hours: int = Query(24, ge=1, le=24 * 365),
+        cursor: str | None = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    return await due_tasks(user, db, 'soon', hours, cursor, limit)
+
+
+@router.get('/due/next')
+async def next_tasks(
+        user: user_dependency,
+        db: read_db_dependency,
+        k: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+        cursor: str | None = None,
+):
+    return await due_tasks(user, db, 'next', None, cursor, k)
+
+
+@router.get('/search')
+async def search_tasks(
+        user: user_dependency,
+        db: read_db_dependency,
+        q: str = Query(..., min_length=1, max_length=200),
+        user_id: int | None = None,
+        cursor: str | None = None,
+        limit: int = Query(20, ge=1, le=100),
+):
+    try:
+        if not user:
+            return api_response(False, 401, "Invalid Authorization header")
+
+        if await check_account_status(user):
+            return api_response(False, 404, "User not found")
+
+        if user_id is not None:
+            if user.get("role") != "admin":
+                return api_response(False, 403, "Forbidden: Admin access required")
+            owner_id = user_id
+        else:
+            owner_id = user.get('user_id')
+
+        terms = search_terms(q)
+        if not terms:
+            return api_response(False, 400, "Search query has no words")
+
+        stmt = task_search(db.bind.dialect.name, terms, owner_id, cursor, limit)
+        rows, next_cursor = search_page((await db.execute(stmt)).all(), limit)
+
+        return api_response(True, 200, {
+            "tasks": [{**serialize_task(task), "rank": score} for task, score in rows],
+            "next_cursor": next_cursor
+        })
+
+    except ValueError as e:
+        return api_response(False, 400, str(e))
+    except Exception as e:
+        return api_response(False, 500, f"An error occurred while searching tasks: {str(e)}")
+
+
+@router.get('/changes')
+async def get_changes(
+        user: user_dependency,
+        db: read_db_dependency,
+        since: str | None = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    # tasks created, updated or deleted after `since`, oldest change first. Without
+    # `since` every task is returned; keep the returned cursor and call again with it,
+    # right away while has_more is true, on the next poll otherwise
+    try:
+        if not user:
+            return api_response(False, 401, "Invalid Authorization header")
+
+        if await check_account_status(user):
+            return api_response(False, 404, "User not found")
+
+        changes, cursor, has_more = await task_changes(db, user.get('user_id'), since, limit)
+
+        return api_response(True, 200, {
+            "changes": changes,
+            "cursor": cursor,
+            "has_more": has_more
+        })
+
+    except CursorExpired as e:
+        return api_response(False, 410, str(e))
+    except ValueError as e:
+        return api_response(False, 400, str(e))
+    except Exception as e:
+        return api_response(False, 500, f"An error occurred while retrieving task changes: {str(e)}")
+
+
+async def stream_principal(authorization, token):
+    # (principal, StreamAccess) or (False, None). Push connections authenticate once
+    # and then hold no db connection, the stream ends when the token expires and
+    # re-checks revocation on its keepalives. Browsers cannot set headers on
+    # EventSource / WebSocket, so ?token= is accepted as well
+    if not authorization and token:
+        authorization = f'Bearer {token}'
+    if not authorization:
+        return False, None
+    async with db_session() as db:
+        user = await get_current_user(db, authorization)
+    if not user or await check_account_status(user):
+        return False, None
+    try:
+        payload = decode_token(authorization.split()[1])
+    except JWTError:
+        # expired in between
+        return False, None
+
+    async def authorized():
+        # legacy tokens are not revocable, the same as in get_current_user
+        return payload.get('type') != ACCESS or not await is_revoked(payload)
+
+    return user, StreamAccess(expires_at=payload.get('exp'), authorized=authorized)
+
+
+@router.get('/events')
+async def task_event_stream(authorization: str | None = Header(None), token: str | None = None):
+    # server-sent events: one `upsert` / `delete` event per task change, same payload
+    # as /task/changes. A `resync` event means the stream fell behind, catch up
+    # through /task/changes and reconnect
+    user, access = await stream_principal(authorization, token)
+    if not user:
+        return api_response(False, 401, "Invalid Authorization header")
+
+    return StreamingResponse(
+        sse_stream(user.get('user_id'), access=access),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@router.websocket('/ws')
+async def task_event_socket(websocket: WebSocket, token: str | None = None):
+    # same events as /task/events, one JSON text message each
+    user, access = await stream_principal(websocket.headers.get('authorization'), token)
+    if not user:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    await websocket_stream(websocket, user.get('user_id'), access=access)
+
+
 @router.patch('/{task_id}')
 async def patch_task(
         task_id: int,
@@ -91,28 +330,34 @@ async def patch_task(
         if not user:
             return api_response(False, 401, 'Not authorized')
 
-        if await check_account_status(user.get('user_id'), db):
+        if await check_account_status(user):
             return api_response(False, 404, 'No user found')
 
-        task = db.query(Tasks).filter(Tasks.id == task_id).first()
+        task = await db.scalar(select(Tasks).where(Tasks.id == task_id))
 
         if not task:
+            archived = await db.scalar(select(TasksArchive.owner_id).where(TasksArchive.id == task_id))
+            if archived is not None and (archived == user.get('user_id') or user.get('role') == 'admin'):
+                return api_response(False, 409, ARCHIVED_READ_ONLY)
             return api_response(False, 404, 'Task not found')
 
         if task.owner_id != user.get('user_id') and user.get('role') != 'admin':
             return api_response(False, 401, 'Not authorized')
 
+        task.version = (await bump_task_version(db, task.owner_id)).get(task.owner_id, 0)
         if data.title is not None:
             task.title = data.title
         if data.description is not None:
             task.description = data.description
         if data.deadline is not None:
             task.deadline = data.deadline
+            task.reminder_sent_at = None
 
-        db.commit()
-        db.refresh(task)
+        await db.commit()
+        await db.refresh(task)
+        await task_events.publish(task.owner_id, [upsert_change(task)])
 
-        return api_response(True, 200, task)
+        return api_response(True, 200, serialize_task(task))
 
     except Exception as e:
         return api_response(False, 500, f"An error occurred while updating task: {str(e)}")
@@ -128,10 +373,12 @@ async def delete_task(
         if not user:
             return api_response(False, 401, 'Not authorized')
 
-        if await check_account_status(user.get('user_id'), db):
+        if await check_account_status(user):
             return api_response(False, 404, 'No user found')
 
-        task = db.query(Tasks).filter(Tasks.id == task_id).first()
+        # archived tasks are read only but can still be deleted
+        task = (await db.scalar(select(Tasks).where(Tasks.id == task_id))
+                or await db.scalar(select(TasksArchive).where(TasksArchive.id == task_id)))
 
         if not task:
             return api_response(False, 404, 'Task not found')
@@ -139,10 +386,160 @@ async def delete_task(
         if task.owner_id != user.get('user_id') and user.get('role') != 'admin':
             return api_response(False, 401, 'Not authorized')
 
-        db.delete(task)
-        db.commit()
+        versions = await bump_task_version(db, task.owner_id)
+        tombstones = tombstone_rows([(task.id, task.owner_id)], versions)
+        await db.execute(insert(TaskTombstones), tombstones)
+        await db.delete(task)
+        await db.commit()
+        await task_events.publish(task.owner_id, [
+            delete_change(row['task_id'], row['version'], row['deleted_at']) for row in tombstones
+        ])
 
         return api_response(True, 200, 'Task deleted successfully')
 
     except Exception as e:
         return api_response(False, 500, f"An error occurred while deleting task: {str(e)}")
+
+
+def batch_result(index, statuscode, data):
+    return {'index': index, 'success': statuscode < 400, 'statuscode': statuscode, 'data': data}
+
+
+@router.post('/batch')
+async def batch_tasks(
+        data: BatchTaskModel,
+        user: user_dependency,
+        db: db_dependency
+):
+    try:
+        if not user:
+            return api_response(False, 401, 'Not authorized')
+
+        if await check_account_status(user):
+            return api_response(False, 404, 'No user found')
+
+        if len(data.create) + len(data.update) + len(data.delete) > MAX_BATCH_SIZE:
+            return api_response(False, 413, f'A batch can hold at most {MAX_BATCH_SIZE} items')
+
+        user_id = user.get('user_id')
+        is_admin = user.get('role') == 'admin'
+        dialect = db.bind.dialect
+
+        # ownership of every task the batch touches, in one query
+        task_ids = {item.id for item in data.update} | set(data.delete)
+        owners = {}
+        archived = set()
+        if task_ids:
+            owners = dict((await db.execute(select(Tasks.id, Tasks.owner_id).where(Tasks.id.in_(task_ids)))).all())
+            missing = task_ids - owners.keys()
+            if missing:
+                rows = (await db.execute(
+                    select(TasksArchive.id, TasksArchive.owner_id).where(TasksArchive.id.in_(missing))
+                )).all()
+                owners.update(rows)
+                archived = {task_id for task_id, _ in rows}
+
+        def ownership_error(task_id):
+            if task_id not in owners:
+                return 404, 'Task not found'
+            if owners[task_id] != user_id and not is_admin:
+                return 401, 'Not authorized'
+            return None
+
+        def update_error(task_id):
+            error = ownership_error(task_id)
+            if not error and task_id in archived:
+                return 409, ARCHIVED_READ_ONLY
+            return error
+
+        touched = [owners[item.id] for item in data.update if not update_error(item.id)]
+        touched += [owners[task_id] for task_id in data.delete if not ownership_error(task_id)]
+        versions = await bump_task_version(db, *touched, *([user_id] if data.create else []))
+
+        # change events per owner, published once the batch is committed
+        events = defaultdict(list)
+
+        created = []
+        if data.create:
+            rows = [{**item.model_dump(), 'owner_id': user_id, 'version': versions.get(user_id, 0)}
+                    for item in data.create]
+            if dialect.insert_executemany_returning:
+                tasks = (await db.scalars(insert(Tasks).returning(Tasks, sort_by_parameter_order=True), rows)).all()
+            else:
+                tasks = [Tasks(**row) for row in rows]
+                db.add_all(tasks)
+                await db.flush()
+            created = [batch_result(index, 201, serialize_task(task)) for index, task in enumerate(tasks)]
+            events[user_id] += [upsert_change(task) for task in tasks]
+
+        updated = []
+        changes = []
+        for index, item in enumerate(data.update):
+            error = update_error(item.id)
+            if error:
+                updated.append(batch_result(index, *error))
+                continue
+            values = item.model_dump(exclude_none=True)
+            if 'deadline' in values:
+                values['reminder_sent_at'] = None
+            if len(values) > 1:
+                changes.append({**values, 'version': versions.get(owners[item.id], 0)})
+            updated.append(batch_result(index, 200, item.id))
+
+        if changes:
+            # bulk UPDATE by primary key, executed as a single executemany
+            await db.execute(update(Tasks), changes)
+
+        updated_ids = [result['data'] for result in updated if result['success']]
+        if updated_ids:
+            fresh = {
+                task.id: task for task in (await db.scalars(
+                    select(Tasks).where(Tasks.id.in_(updated_ids)).execution_options(populate_existing=True)
+                )).all()
+            }
+            for result in updated:
+                if result['success']:
+                    task = fresh[result['data']]
+                    result['data'] = serialize_task(task)
+                    events[task.owner_id].append(upsert_change(task))
+
+        deleted = []
+        for index, task_id in enumerate(data.delete):
+            error = ownership_error(task_id)
+            deleted.append(batch_result(index, *error) if error else batch_result(index, 200, task_id))
+
+        delete_ids = [result['data'] for result in deleted if result['success']]
+        if delete_ids:
+            gone = set()
+            for model in (Tasks, TasksArchive):
+                ids = [task_id for task_id in delete_ids if (task_id in archived) == model.archived]
+                if not ids:
+                    continue
+                stmt = delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False)
+                if dialect.delete_returning:
+                    gone |= set((await db.execute(stmt.returning(model.id))).scalars().all())
+                else:
+                    await db.execute(stmt)
+                    gone |= set(ids)
+            for result in deleted:
+                if result['success'] and result['data'] not in gone:
+                    result.update(batch_result(result['index'], 404, 'Task not found'))
+            if gone:
+                tombstones = tombstone_rows([(task_id, owners[task_id]) for task_id in sorted(gone)], versions)
+                await db.execute(insert(TaskTombstones), tombstones)
+                for row in tombstones:
+                    events[row['owner_id']].append(delete_change(row['task_id'], row['version'], row['deleted_at']))
+
+        await db.commit()
+        for owner_id, owner_events in events.items():
+            await task_events.publish(owner_id, owner_events)
+
+        return api_response(True, 200, {
+            'created': created,
+            'updated': updated,
+            'deleted': deleted
+        })
+
+    except Exception as e:
+        await db.rollback()
+        return api_response(False, 500, f"An error occurred while processing the batch: {str(e)}")
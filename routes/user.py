@@ -1,30 +1,23 @@
-import datetime
-from datetime import timedelta
 from typing import Annotated
 from fastapi import APIRouter, Depends, UploadFile, Form, File, Header
 from pydantic import EmailStr
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models.sign_up_request import UserRequest
-from tables.rate_limit import RateLimit
+from tables.tasks import utc_now
 from tables.users import Users
-from utils.cloudinary_upload import create_upload_file
-from passlib.context import CryptContext
+from utils.storage import save_avatar, UploadError
+from config import settings
 from database import get_db
 from utils.api_response import api_response, serialize_user
-from jose import jwt, JWTError
-from dotenv import load_dotenv
+from utils.cache import create_cache
+from utils.passwords import password_hasher
+from utils.rate_limit import RateLimiter
+from utils.tokens import (ACCESS, REFRESH, issue_tokens, decode_token, principal_from_claims, is_revoked,
+                          revoke_token, revoke_user_tokens)
+from jose import JWTError
+import math
 import re
-import os
-
-
-#loads the env file
-
-load_dotenv()
-
-
-#scret key and algo from env file
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGO = os.getenv("ALGO")
 
 
 #router prefix for example /users /tasks and tags for docs
@@ -33,46 +26,64 @@ router = APIRouter(
     tags=['User']
 )
 
-# creating context for encrypt and decrypt the password
-bcrypt_context = CryptContext(schemes=['bcrypt'])
-
-# creating users dependency type -> Session (from sql alchemy) -> depends on get
-db_dependency = Annotated[Session, Depends(get_db)]
+# authenticated principals (id, role, is_deleted) keyed by email, so an authenticated
+# request does not have to load the user row again. PRINCIPAL_CACHE = memory | redis | off
+principal_cache = create_cache(
+    settings.principal_cache,
+    prefix='principal:',
+    maxsize=settings.principal_cache_size,
+    ttl=settings.principal_cache_ttl,
+)
 
+# login / sign-up throttling, backend picked by RATE_LIMIT_BACKEND (memory | redis).
+# failed logins per email: 5 a day, cleared by a successful login
+login_email_limiter = RateLimiter('login-email', times=5, seconds=24 * 60 * 60)
+login_ip_limiter = RateLimiter('login-ip', times=settings.login_ip_limit, seconds=60 * 60)
+signup_ip_limiter = RateLimiter('signup-ip', times=settings.signup_ip_limit, seconds=60 * 60)
 
-async def create_access_token(email: EmailStr, expires_update: timedelta):
-    try:
-        user = {"email": email}
-        expires = datetime.datetime.now(datetime.timezone.utc) + expires_update
-        user.update({'exp': expires})
-        return jwt.encode(user, SECRET_KEY, algorithm=ALGO)
-    except Exception as e:
-        return api_response(False, 500, f"Error creating access token: {str(e)}")
+# creating users dependency type -> AsyncSession (from sql alchemy) -> depends on get
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
 
 async def get_current_user(db: db_dependency, Authorization: str = Header(...)):
     try:
         if not Authorization or not (Authorization.startswith("Bearer ") or Authorization.startswith("bearer ")):
-            return api_response(False, 401, "Invalid Authorization header")
+            print("Invalid Authorization header")
+            return False
 
         token = Authorization.split()[1]
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGO])
+        payload = decode_token(token)
+
+        # fast path, the claims are the principal and no user row is loaded
+        if payload.get('type') == ACCESS:
+            if await is_revoked(payload):
+                print('Token revoked')
+                return False
+            return principal_from_claims(payload)
+
+        if payload.get('type') == REFRESH:
+            print('Refresh token used as access token')
+            return False
 
+        # tokens issued before the claims carried the principal
         email = payload.get('email')
 
         if email is None:
-            return api_response(False, 401, 'Invalid token')
+            print('Invalid token: no email claim')
+            return False
 
-        user = get_user_by_email(email, db)
+        principal = await principal_cache.get(email)
 
+        if principal is None:
+            user = await get_user_by_email(email, db)
 
-        if not user:
-            return api_response(False, 404, 'Account not found')
+            if not user:
+                return False
 
-        if user.is_admin:
-            return {'email': email, 'user_id': user.id, 'role': 'admin'}
+            principal = build_principal(user)
+            await principal_cache.set(email, principal)
 
-        return {'email': email, 'user_id': user.id}
+        return dict(principal)
     except JWTError as e:
         print(f'JWT token error: {str(e)}')
         return False
@@ -85,28 +96,54 @@ async def get_current_user(db: db_dependency, Authorization: str = Header(...)):
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
+def build_principal(user: Users) -> dict:
+    return {
+        'email': user.email,
+        'user_id': user.id,
+        'role': 'admin' if user.is_admin else 'user',
+        'is_deleted': bool(user.is_deleted),
+    }
+
+
+async def invalidate_principal(*emails):
+    # must be called after every write that changes email, role or deleted state
+    await principal_cache.delete(*[email for email in emails if email])
+
+
 async def verify_password(email: EmailStr, password: str, db):
     try:
-        user = get_user_by_email(email, db)
-        if user and bcrypt_context.verify(password, user.password):
-            return user
-        return False
+        user = await get_user_by_email(email, db)
+        if not user:
+            return False
+
+        # bcrypt runs in the password worker pool, not on the event loop
+        valid, new_hash = await password_hasher.verify_and_update(password, user.password)
+        if not valid:
+            return False
+
+        # stored hash used an old cost, upgrade it transparently
+        if new_hash:
+            user.password = new_hash
+            await db.commit()
+
+        return user
     except Exception as e:
-        return api_response(False, 500, f"Error verifying password: {str(e)}")
+        print(f"Error verifying password: {str(e)}")
+        return False
 
 
-def get_user_by_email(email: EmailStr, db: db_dependency):
+async def get_user_by_email(email: EmailStr, db: db_dependency):
     try:
-        return db.query(Users).filter(Users.email == email).first()
+        return await db.scalar(select(Users).where(Users.email == email))
     except Exception as e:
         print(f"Error fetching user by email: {str(e)}")
         return None
 
 
 
-def get_user_by_id(id: str, db: db_dependency):
+async def get_user_by_id(id: int, db: db_dependency):
     try:
-        return db.query(Users).filter(Users.id == id).first()
+        return await db.scalar(select(Users).where(Users.id == id))
     except Exception as e:
         print(f"Error fetching user by ID: {str(e)}")
         return None
@@ -114,44 +151,7 @@ def get_user_by_id(id: str, db: db_dependency):
 
 
 
-def set_rate_limiter(email: EmailStr, db):
-    try:
-        user = db.query(RateLimit).filter(RateLimit.email == email).first()
-        today = datetime.date.today()
-
-        if not user:
-            db.add(RateLimit(email=email, attempt=1, attempt_date=today))
-            db.commit()
-            return True
-
-        if user.attempt_date != today:
-            user.attempt = 1
-            user.attempt_date = today
-            db.commit()
-            return True
-
-        # Same day → check limit
-        if user.attempt >= 5:
-            return False
-
-        user.attempt += 1
-        db.commit()
-        return True
-
-    except Exception as e:
-        return api_response(False, 500, f"Error setting the rate limiter : {str(e)}")
-
-def reset_rate_limit(email : EmailStr , db):
-    try:
-        user = db.query(RateLimit).filter(RateLimit.email == email).first()
-        db.delete(user)
-        db.commit()
-    except Exception as e:
-        return api_response(False, 500, f"Error resetting the rate limiter  {str(e)}")
-
-
-
-@router.post('/sign-up')
+@router.post('/sign-up', dependencies=[Depends(signup_ip_limiter)])
 async def sign_up(
         db: db_dependency,
         username: str = Form(...),
@@ -164,11 +164,8 @@ async def sign_up(
         # Validate request data
         UserRequest(username=username, email=email, password=password, full_name=full_name)
 
-        # Upload avatar
-        url = await create_upload_file(file)
-
         # Check if the user already exists
-        user = get_user_by_email(email, db)
+        user = await get_user_by_email(email, db)
         if user:
             return api_response(False, 409, {'error': 'Email already exists, try to login'})
 
@@ -184,35 +181,43 @@ async def sign_up(
         if not re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
             return api_response(False, 400, {'error': 'Password must contain at least one special character.'})
 
+        # Upload avatar, only once the request is known to be valid
+        try:
+            url, thumbnail_url = await save_avatar(file)
+        except UploadError as e:
+            return api_response(False, 400, {'error': str(e)})
+
 
         user = Users(
             username=username,
             email=email,
-            password=bcrypt_context.hash(password),
+            password=await password_hasher.hash(password),
             full_name=full_name,
-            avatar_url=url
+            avatar_url=url,
+            avatar_thumbnail_url=thumbnail_url
         )
 
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
 
         return api_response(True, 200, {'user': serialize_user(user)})
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return api_response(False, 404, {'error': f"Error signing up: {str(e)}"})
 
 
-@router.post('/login')
+@router.post('/login', dependencies=[Depends(login_ip_limiter)])
 async def login(
         db: db_dependency,
         email: EmailStr = Form(...),
         password: str = Form(...)
 ):
     try:
-        if not set_rate_limiter(email , db):
-            return api_response(False, 429, "Too Many request try to login after 24 hours")
+        allowed, retry_after = await login_email_limiter.hit(email)
+        if not allowed:
+            return api_response(False, 429, f"Too Many request try to login after {math.ceil(retry_after / 3600)} hours")
 
         user = await verify_password(email, password, db)
 
@@ -222,19 +227,56 @@ async def login(
         if user.is_deleted:
             return api_response(False, 404, 'Account not found')
 
-        access_token = await create_access_token(user.email, timedelta(minutes=60))
+        await login_email_limiter.reset(email)
 
-        reset_rate_limit(email , db)
-
-        return api_response(True, 200, {
-            'access_token': access_token,
-            'token_type': 'bearer'
-        })
+        return api_response(True, 200, issue_tokens(user))
 
     except Exception as e:
         return api_response(False, 500, f"Error during login: {str(e)}")
 
 
+@router.post('/refresh')
+async def refresh(db: db_dependency, refresh_token: str = Form(...)):
+    # trades a refresh token for a new access + refresh pair, the used refresh
+    # token is revoked so each one works once
+    try:
+        try:
+            payload = decode_token(refresh_token)
+        except JWTError:
+            return api_response(False, 401, 'Invalid refresh token')
+
+        if payload.get('type') != REFRESH or await is_revoked(payload):
+            return api_response(False, 401, 'Invalid refresh token')
+
+        # the database has the final say on deletes and password changes
+        user = await get_user_by_id(int(payload['sub']), db)
+        if not user or user.is_deleted or (user.token_version or 0) != payload.get('tv'):
+            return api_response(False, 401, 'Invalid refresh token')
+
+        await revoke_token(payload)
+
+        return api_response(True, 200, issue_tokens(user))
+
+    except Exception as e:
+        return api_response(False, 500, f"Error refreshing token: {str(e)}")
+
+
+@router.post('/logout')
+async def logout(Authorization: str = Header(...), refresh_token: str = Form(None)):
+    try:
+        tokens = [Authorization.split()[-1]] + ([refresh_token] if refresh_token else [])
+        for token in tokens:
+            try:
+                await revoke_token(decode_token(token))
+            except JWTError:
+                pass
+
+        return api_response(True, 200, 'Logged out')
+
+    except Exception as e:
+        return api_response(False, 500, f"Error during logout: {str(e)}")
+
+
 @router.patch('/update')
 async def update(
         db: db_dependency,
@@ -254,9 +296,9 @@ async def update(
         if user_id is not None:
             if user.get("role") != "admin":
                 return api_response(False, 403, "Forbidden: Admin access required")
-            user_db =  get_user_by_id(str(user_id), db)
+            user_db = await get_user_by_id(user_id, db)
         else:
-            user_db =  get_user_by_id(user.get('user_id'), db)
+            user_db = await get_user_by_id(user.get('user_id'), db)
 
 
 
@@ -267,24 +309,33 @@ async def update(
         if user_db.is_deleted and user.get("role") != "admin":
             return api_response(False, 404, 'Account not found')
 
+        old_email = user_db.email
+
         if email is not None:
             user_db.email = email
         if full_name is not None:
             user_db.full_name = full_name
         if password is not None:
-            user_db.password = bcrypt_context.hash(password)
+            user_db.password = await password_hasher.hash(password)
+            user_db.token_version = (user_db.token_version or 0) + 1
 
         if file:
-            url = await create_upload_file(file)
-            user_db.avatar_url = url
-
-        db.commit()
-        db.refresh(user_db)
+            try:
+                user_db.avatar_url, user_db.avatar_thumbnail_url = await save_avatar(file)
+            except UploadError as e:
+                await db.rollback()
+                return api_response(False, 400, str(e))
+
+        await db.commit()
+        await db.refresh(user_db)
+        await invalidate_principal(old_email, user_db.email)
+        if password is not None:
+            await revoke_user_tokens(user_db.id, user_db.token_version)
 
         return api_response(True, 200, serialize_user(user_db))
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return api_response(False, 500, f"Error updating user: {str(e)}")
 
 
@@ -294,7 +345,7 @@ async def soft_delete(db: db_dependency, user: user_dependency):
         if not user:
             return api_response(False, 404, 'Account not found')
 
-        user_db = get_user_by_id(user.get('user_id'), db)
+        user_db = await get_user_by_id(user.get('user_id'), db)
 
         if not user_db:
             return api_response(False, 404, 'Account not found')
@@ -306,13 +357,17 @@ async def soft_delete(db: db_dependency, user: user_dependency):
             return api_response(False, 401, 'Not authorized')
 
         user_db.is_deleted = True
+        user_db.deleted_at = utc_now()
+        user_db.token_version = (user_db.token_version or 0) + 1
 
-        db.commit()
+        await db.commit()
+        await invalidate_principal(user_db.email)
+        await revoke_user_tokens(user_db.id, user_db.token_version)
 
         return api_response(True, 200, 'Your account is deleted')
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return api_response(False, 500, f"Error during soft delete: {str(e)}")
 
 
@@ -322,7 +377,7 @@ async def hard_delete(db: db_dependency, user: user_dependency):
         if not user:
             return api_response(False, 404, 'Account not found')
 
-        user_db = get_user_by_id(user.get('user_id'), db)
+        user_db = await get_user_by_id(user.get('user_id'), db)
 
         if not user_db:
             return api_response(False, 404, 'Account not found')
@@ -330,11 +385,15 @@ async def hard_delete(db: db_dependency, user: user_dependency):
         if user_db.id != user.get('user_id') and user.get('role') != 'admin':
             return api_response(False, 401, 'Not authorized')
 
-        db.delete(user_db)
-        db.commit()
+        # the row is gone, so the bump only lives in the revocation list
+        token_version = (user_db.token_version or 0) + 1
+        await db.delete(user_db)
+        await db.commit()
+        await invalidate_principal(user_db.email)
+        await revoke_user_tokens(user_db.id, token_version)
 
         return api_response(True, 200, 'Your account is deleted')
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return api_response(False, 500, f"Error during hard delete: {str(e)}")
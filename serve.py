@@ -0,0 +1,110 @@
+# production entrypoint for long running servers: python serve.py [--workers N]
+#
+# uvicorn's supervisor pre-forks WEB_CONCURRENCY worker processes (default: the cores
+# this process may run on) and restarts any that die. Every worker runs uvloop and
+# httptools. On SIGTERM / SIGINT the workers stop accepting, give in flight requests
+# SERVER_GRACEFUL_TIMEOUT seconds to finish, then run the lifespan shutdown (background
+# jobs, event broker, geo log, database pools). Open /task/events and /task/ws streams
+# are cut at the timeout, their clients reconnect to the next instance.
+#
+# workers share nothing in memory. With more than one, these have to be redis
+# (REDIS_URL), otherwise each worker only sees its own state:
+#   TOKEN_REVOCATION_BACKEND  logout / password change / deletes revoke tokens in one
+#                             worker only, the others accept them until they expire
+#   PRINCIPAL_CACHE           same for legacy tokens, up to PRINCIPAL_CACHE_TTL (or off)
+#   RATE_LIMIT_BACKEND        every limit is multiplied by the worker count
+#   TASK_EVENTS_BACKEND       push events only reach clients of the worker that wrote
+#   REPLICA_STICKY_BACKEND    read-your-writes only holds on the worker that wrote
+# serve.py warns about every one still on memory.
+#
+# every worker has its own pools, so DB_POOL_SIZE / DB_MAX_OVERFLOW apply per worker.
+# In async mode they size the async engine, the sync engine next to it keeps
+# DB_SYNC_POOL_SIZE / DB_SYNC_MAX_OVERFLOW. Set DB_MAX_CONNECTIONS to what the primary
+# allows this deployment and the budget is split over the workers instead. Serverless platforms import
+# main:app directly and never come through here.
+
+import argparse
+import os
+import sys
+import uvicorn
+from config import settings
+
+# pool_size : max_overflow, like the 5 / 10 defaults
+POOL_SHARE = 3
+
+
+def default_workers():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def pool_budget(workers, max_connections):
+    # (pool_size, max_overflow) of the engine that serves requests. async mode keeps a
+    # sync engine next to the async one (migrations, scheduler lock), its fixed small
+    # pool comes off the top and the rest goes to the async engine
+    reserved = settings.db_sync_pool_size + settings.db_sync_max_overflow if settings.db_mode == 'async' else 0
+    per_worker = max_connections // workers - reserved
+    if per_worker < 1:
+        raise ValueError(f'DB_MAX_CONNECTIONS={max_connections} is too low for {workers} workers '
+                         f'with {reserved} sync connections each')
+    pool_size = max(per_worker // POOL_SHARE, 1)
+    return pool_size, per_worker - pool_size
+
+
+# setting -> env var, the ones that must be shared between workers
+SHARED_BACKENDS = {
+    'token_revocation_backend': 'TOKEN_REVOCATION_BACKEND',
+    'principal_cache': 'PRINCIPAL_CACHE',
+    'rate_limit_backend': 'RATE_LIMIT_BACKEND',
+    'task_events_backend': 'TASK_EVENTS_BACKEND',
+    'replica_sticky_backend': 'REPLICA_STICKY_BACKEND',
+}
+
+
+def per_worker_backends():
+    # stickiness only matters with replicas
+    skip = set() if settings.database_replica_urls else {'replica_sticky_backend'}
+    return [env for name, env in SHARED_BACKENDS.items() if name not in skip and getattr(settings, name) == 'memory']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=settings.web_concurrency or default_workers())
+    parser.add_argument('--host', default=settings.server_host)
+    parser.add_argument('--port', type=int, default=settings.server_port)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        for env in per_worker_backends():
+            print(f'WARNING: {env}=memory is per worker, set it to redis when running {args.workers} workers',
+                  file=sys.stderr, flush=True)
+
+    if settings.db_max_connections:
+        try:
+            pool_size, max_overflow = pool_budget(args.workers, settings.db_max_connections)
+        except ValueError as e:
+            parser.error(str(e))
+        # workers are fresh interpreters, they read their settings from the environment
+        os.environ['DB_POOL_SIZE'] = str(pool_size)
+        os.environ['DB_MAX_OVERFLOW'] = str(max_overflow)
+        print(f'{args.workers} workers, pool_size={pool_size} max_overflow={max_overflow} each', flush=True)
+
+    uvicorn.run(
+        'main:app',
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop='uvloop',
+        http='httptools',
+        lifespan='on',
+        backlog=settings.server_backlog,
+        timeout_keep_alive=settings.server_keep_alive,
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+        access_log=settings.server_access_log,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, Date, DateTime
+from database import Base
+
+
+class TaskDeadlineStats(Base):
+    # tasks per deadline day for /admin/stats/deadlines, rebuilt with task_stats.
+    # weeks and months are rolled up from the days
+    __tablename__ = 'task_deadline_stats'
+    day = Column(Date, primary_key=True)
+    tasks = Column(Integer, nullable=False, default=0)
+    archived = Column(Integer, nullable=False, default=0)
+    refreshed_at = Column(DateTime, nullable=False)
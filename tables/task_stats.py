@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, DateTime
+from database import Base
+
+
+class TaskStats(Base):
+    # per-user task counts for /admin/stats, rebuilt by the stats job when
+    # ADMIN_STATS_SOURCE=summary. overdue / due_soon are as of refreshed_at
+    __tablename__ = 'task_stats'
+    owner_id = Column(Integer, primary_key=True, autoincrement=False)
+    tasks = Column(Integer, nullable=False, default=0)
+    overdue = Column(Integer, nullable=False, default=0)
+    due_soon = Column(Integer, nullable=False, default=0)
+    archived = Column(Integer, nullable=False, default=0)
+    refreshed_at = Column(DateTime, nullable=False)
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, DateTime, Index
+from database import Base
+
+
+class TaskTombstones(Base):
+    # one row per deleted task so /task/changes can report the delete,
+    # removed again by the compaction job after TASK_TOMBSTONE_DAYS
+    __tablename__ = 'task_tombstones'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(Integer, nullable=False)
+    owner_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False)
+
+    # kept in sync with migrations/versions/0006_task_sync.py
+    __table_args__ = (
+        Index('ix_task_tombstones_owner_id_version', 'owner_id', 'version', 'task_id'),
+        Index('ix_task_tombstones_deleted_at', 'deleted_at'),
+    )
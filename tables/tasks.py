@@ -1,7 +1,21 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from database import Base
 
 
+def utc_now():
+    # naive utc, same as the deadlines
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def naive_utc(value):
+    # columns are naive utc, asyncpg refuses aware datetimes for them and the other
+    # drivers drop the offset. Naive input is taken as utc already
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 class Tasks(Base):
     __tablename__ = 'tasks'
     id = Column(Integer,primary_key=True ,    index=True, autoincrement=True)
@@ -9,4 +23,21 @@ class Tasks(Base):
     description = Column(String(500))
     deadline = Column(DateTime)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime, default=utc_now)
+    updated_at = Column(DateTime, default=utc_now, onupdate=utc_now)
+    # the owner's users.task_version of the write that last touched this row
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+    # set by the deadline reminder job, cleared when the deadline changes
+    reminder_sent_at = Column(DateTime)
+
+    # TasksArchive rows say True
+    archived = False
+
+    # kept in sync with migrations/versions/0002_task_user_indexes.py and 0006_task_sync.py
+    __table_args__ = (
+        Index('ix_tasks_owner_id_id', 'owner_id', 'id'),
+        Index('ix_tasks_owner_id_deadline', 'owner_id', 'deadline', 'id'),
+        Index('ix_tasks_deadline_id', 'deadline', 'id'),
+        Index('ix_tasks_owner_id_version', 'owner_id', 'version', 'id'),
+    )
 
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from database import Base
+
+
+class TasksArchive(Base):
+    # cold storage for tasks whose deadline passed more than ARCHIVE_AFTER_DAYS ago,
+    # filled by the archive job in utils/jobs.py. Rows keep their task id and are
+    # read only, listings show them with include_archived=true
+    __tablename__ = 'tasks_archive'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    title = Column(String(50))
+    description = Column(String(500))
+    deadline = Column(DateTime)
+    owner_id = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+    archived_at = Column(DateTime, nullable=False)
+
+    archived = True
+
+    # same access paths as tasks, kept in sync with migrations/versions/0009_tasks_archive.py
+    __table_args__ = (
+        Index('ix_tasks_archive_owner_id_id', 'owner_id', 'id'),
+        Index('ix_tasks_archive_owner_id_deadline', 'owner_id', 'deadline', 'id'),
+        Index('ix_tasks_archive_deadline_id', 'deadline', 'id'),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer , String , Boolean
+from sqlalchemy import Column, Integer , String , Boolean, DateTime, Index, text
 from database import Base
 
 
@@ -8,8 +8,22 @@ class Users(Base):
     username = Column(String(20) , nullable=False )
     email = Column(String(50) , nullable=False , unique=True)
     avatar_url = Column(String(250))
+    avatar_thumbnail_url = Column(String(250))
     full_name = Column(String(50))
     password = Column(String(100))
     is_deleted = Column(Boolean ,  default=False)
+    # when is_deleted was set, the purge job removes the account some days later
+    deleted_at = Column(DateTime)
     is_admin = Column(Boolean , default=False)
+    # bumped on every write to this user's tasks, drives the task listing ETags
+    task_version = Column(Integer, nullable=False, default=0, server_default='0')
+    # bumped on password change and deletes, tokens carrying an older version are rejected
+    token_version = Column(Integer, nullable=False, default=0, server_default='0')
+
+    # partial index on accounts that are not soft deleted
+    __table_args__ = (
+        Index('ix_users_active', 'id',
+              postgresql_where=text('is_deleted = false'),
+              sqlite_where=text('is_deleted = 0')),
+    )
 
@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# settings are read once, on the first import of config. Point the app at a throwaway
+# sqlite database and keep the background services quiet before any test imports it
+WORKDIR = tempfile.mkdtemp(prefix='tasks-tests-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORKDIR, "app.db")}'
+os.environ['DATABASE_REPLICA_URLS'] = ''
+os.environ['SCHEDULER'] = 'off'
+os.environ['SCHEMA_ON_STARTUP'] = 'off'
+os.environ.setdefault('SECRET_KEY', 'test-secret')
@@ -0,0 +1,22 @@
+from sqlalchemy import create_engine
+import migrations
+from migrations.check import check_indexes
+
+
+def test_hot_queries_use_their_indexes(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "indexes.db"}')
+    try:
+        migrations.upgrade(engine)
+        assert all(applied for _, _, applied in migrations.status(engine))
+        assert check_indexes(engine) == []
+    finally:
+        engine.dispose()
+
+
+def test_upgrade_is_idempotent(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "indexes.db"}')
+    try:
+        assert migrations.upgrade(engine)
+        assert migrations.upgrade(engine) == []
+    finally:
+        engine.dispose()
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from sqlalchemy import create_engine, insert, select
+from starlette.requests import Request
+import database
+import migrations
+from tables.users import Users
+
+
+def make_database(url, name):
+    engine = create_engine(url)
+    try:
+        migrations.upgrade(engine)
+        with engine.begin() as conn:
+            conn.execute(insert(Users).values(username=name, email=f'{name}@example.com'))
+    finally:
+        engine.dispose()
+
+
+def request(method, token):
+    headers = [(b'authorization', f'Bearer {token}'.encode())]
+    return Request({'type': 'http', 'method': method, 'path': '/', 'headers': headers})
+
+
+async def read_from(key=None):
+    # username of the row the database that served the read holds
+    async with database.read_session(key) as db:
+        return await db.scalar(select(Users.username))
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await database.dispose_engines()
+    return asyncio.run(main())
+
+
+@pytest.fixture(scope='module', autouse=True)
+def primary():
+    make_database(database.engine.url, 'primary')
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    # a second sqlite file stands in for the replica
+    url = f'sqlite:///{tmp_path / "replica.db"}'
+    make_database(url, 'replica')
+    replica = database.Replica(url, 'replica-test')
+    monkeypatch.setattr(database, 'replicas', [replica])
+    return replica
+
+
+def test_reads_go_to_the_replica(replica):
+    assert run(read_from()) == 'replica'
+    assert run(read_from('reader')) == 'replica'
+
+
+def test_reads_rotate_over_the_replicas(replica, tmp_path, monkeypatch):
+    url = f'sqlite:///{tmp_path / "second.db"}'
+    make_database(url, 'second')
+    monkeypatch.setattr(database, 'replicas', [replica, database.Replica(url, 'replica-second')])
+
+    assert {run(read_from()) for _ in range(4)} == {'replica', 'second'}
+
+
+def test_reads_use_the_primary_without_replicas(monkeypatch):
+    monkeypatch.setattr(database, 'replicas', [])
+    assert run(read_from()) == 'primary'
+
+
+def test_reads_stick_to_the_primary_after_a_write(replica):
+    async def scenario():
+        writer = request('POST', 'writer')
+        async for _ in database.get_db(writer):
+            pass
+        return await read_from(database.sticky_key(writer)), await read_from(database.sticky_key(request('GET', 'other')))
+
+    assert run(scenario()) == ('primary', 'replica')
+
+
+def test_get_requests_do_not_stick(replica):
+    async def scenario():
+        reader = request('GET', 'reader')
+        async for _ in database.get_db(reader):
+            pass
+        return await read_from(database.sticky_key(reader))
+
+    assert run(scenario()) == 'replica'
+
+
+def test_reads_fall_back_when_the_replica_is_down(tmp_path, monkeypatch):
+    replica = database.Replica(f'sqlite:///{tmp_path / "missing" / "replica.db"}', 'replica-down')
+    monkeypatch.setattr(database, 'replicas', [replica])
+
+    assert run(read_from()) == 'primary'
+    assert not replica.healthy
+    assert replica.failures == 1
+    assert database.replica_stats() == [{'engine': 'replica-down', 'healthy': False, 'failures': 1}]
+
+    # skipped until REPLICA_RETRY_SECONDS have passed, not tried on every read
+    assert run(read_from()) == 'primary'
+    assert replica.failures == 1
+
+    # back in rotation once it answers again
+    (tmp_path / 'missing').mkdir()
+    make_database(f'sqlite:///{tmp_path / "missing" / "replica.db"}', 'replica')
+    replica.down_until = 0
+    assert run(read_from()) == 'replica'
@@ -0,0 +1,38 @@
+import asyncio
+import time
+from utils.events import StreamAccess, sse_stream
+
+
+def collect(stream, limit=5):
+    async def main():
+        return [chunk async for chunk in stream]
+    return asyncio.run(asyncio.wait_for(main(), limit))
+
+
+def test_stream_ends_when_the_token_expires():
+    started = time.monotonic()
+    chunks = collect(sse_stream(1, ping=0.05, access=StreamAccess(expires_at=time.time() + 0.3)))
+    assert 0.25 < time.monotonic() - started < 2
+    assert chunks[0] == 'retry: 3000\n\n'
+    assert ': ping\n\n' in chunks
+
+
+def test_stream_ends_once_the_token_is_revoked():
+    revoked_at = time.monotonic() + 0.3
+
+    async def authorized():
+        return time.monotonic() < revoked_at
+
+    started = time.monotonic()
+    collect(sse_stream(1, ping=0.05, access=StreamAccess(authorized=authorized, every=0.05)))
+    assert 0.25 < time.monotonic() - started < 2
+
+
+def test_stream_without_limits_keeps_pinging():
+    async def main():
+        stream = sse_stream(1, ping=0.05)
+        chunks = [await stream.__anext__() for _ in range(3)]
+        await stream.aclose()
+        return chunks
+
+    assert asyncio.run(main()) == ['retry: 3000\n\n', ': ping\n\n', ': ping\n\n']
@@ -0,0 +1,42 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from utils import tokens
+from utils.cache import MemoryCache
+
+
+def payload(user_id=7, token_version=0, jti='a'):
+    return {'sub': str(user_id), 'tv': token_version, 'jti': jti, 'exp': 2 ** 40}
+
+
+@pytest.fixture(autouse=True)
+def stores(monkeypatch):
+    # a tiny jti store, so any churn would evict
+    monkeypatch.setattr(tokens, 'revocations', MemoryCache(maxsize=2))
+    monkeypatch.setattr(tokens, 'token_versions', MemoryCache(maxsize=None))
+
+
+def test_older_token_versions_are_revoked():
+    async def scenario():
+        await tokens.revoke_user_tokens(7, 1)
+        return await tokens.is_revoked(payload(token_version=0)), await tokens.is_revoked(payload(token_version=1))
+
+    assert asyncio.run(scenario()) == (True, False)
+
+
+def test_version_survives_jti_churn():
+    async def scenario():
+        await tokens.revoke_user_tokens(7, 1)
+        for number in range(10):
+            await tokens.revoke_token(payload(user_id=number, jti=f'churn-{number}'))
+        return await tokens.is_revoked(payload(token_version=0))
+
+    assert asyncio.run(scenario())
+
+
+def test_version_check_fails_closed(monkeypatch):
+    async def unavailable(key):
+        raise ConnectionError('redis is down')
+
+    monkeypatch.setattr(tokens, 'token_versions', SimpleNamespace(get=unavailable))
+    assert asyncio.run(tokens.is_revoked(payload()))
@@ -1,13 +1,17 @@
+from fastapi.responses import ORJSONResponse
 from tables.tasks import Tasks
 from tables.users import Users
 
 
+# handlers return this Response directly, so FastAPI skips its jsonable_encoder pass
+# and orjson encodes the body. `description` must already be built from plain
+# values, use the serialize_* helpers below instead of passing ORM objects
 def api_response(success , statuscode , description):
-    return {
+    return ORJSONResponse({
         'success' : success ,
         'statuscode' : statuscode,
         'data' : description
-    }
+    })
 
 def serialize_user(user: Users) -> dict:
     return {
@@ -16,6 +20,15 @@ def serialize_user(user: Users) -> dict:
         "email": user.email,
         "full_name": user.full_name,
         "avatar_url": user.avatar_url,
+        "avatar_thumbnail_url": user.avatar_thumbnail_url,
+    }
+
+
+def serialize_admin_user(user: Users) -> dict:
+    return {
+        **serialize_user(user),
+        "is_deleted": user.is_deleted,
+        "is_admin": user.is_admin,
     }
 
 
@@ -25,5 +38,8 @@ def serialize_task(task : Tasks) -> dict:
         "task_title" : task.title,
         "task_description": task.description,
         "task_deadline" : task.deadline,
-        "task_owner" : task.owner_id
+        "task_owner" : task.owner_id,
+        "task_created_at" : task.created_at,
+        "task_updated_at" : task.updated_at,
+        "task_archived" : task.archived
     }
\ No newline at end of file
@@ -0,0 +1,128 @@
+import json
+import time
+from collections import OrderedDict
+from config import settings
+
+MISSING = object()
+
+
+class TTLCache:
+    # bounded LRU cache where every entry also expires after ttl seconds,
+    # maxsize=None never evicts
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, MISSING)
+        if entry is MISSING:
+            return default
+
+        value, expires = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while self.maxsize is not None and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+# async key/value backends with the same interface so callers can switch
+# between an in-process cache and redis (shared by every worker)
+
+class MemoryCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key):
+        return self._cache.get(key)
+
+    async def set(self, key, value, ttl=None):
+        self._cache.set(key, value, ttl)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._cache.delete(key)
+
+
+class RedisCache:
+    # strict: get raises on an outage instead of reporting a miss, for callers that
+    # must not treat "unknown" as "absent"
+
+    def __init__(self, url, prefix='', ttl=300, strict=False):
+        self.url = url
+        self.prefix = prefix
+        self.ttl = ttl
+        self.strict = strict
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    async def get(self, key):
+        try:
+            value = await self.client.get(self.prefix + str(key))
+        except Exception as e:
+            # a cache outage must not take the api down, callers fall back to the db
+            print(f'Redis cache get failed: {str(e)}')
+            if self.strict:
+                raise
+            return None
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key, value, ttl=None):
+        try:
+            await self.client.set(self.prefix + str(key), json.dumps(value, default=str), ex=ttl or self.ttl)
+        except Exception as e:
+            print(f'Redis cache set failed: {str(e)}')
+
+    async def delete(self, *keys):
+        if not keys:
+            return
+        try:
+            await self.client.delete(*[self.prefix + str(key) for key in keys])
+        except Exception as e:
+            print(f'Redis cache delete failed: {str(e)}')
+
+
+class NullCache:
+    async def get(self, key):
+        return None
+
+    async def set(self, key, value, ttl=None):
+        pass
+
+    async def delete(self, *keys):
+        pass
+
+
+def create_cache(backend, prefix='', maxsize=1024, ttl=300, strict=False):
+    if backend == 'redis':
+        return RedisCache(settings.redis_url, prefix=prefix, ttl=ttl, strict=strict)
+    if backend == 'memory':
+        return MemoryCache(maxsize=maxsize, ttl=ttl)
+    return NullCache()
@@ -1,21 +1,28 @@
-import cloudinary
-import os
-from fastapi import UploadFile , File
-from dotenv import load_dotenv
-import  cloudinary.uploader
+from functools import lru_cache
+from config import settings
 
-load_dotenv()
 
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET")
-)
+@lru_cache
+def cloudinary_uploader():
+    # the sdk is imported and configured on the first upload, not at startup
+    import cloudinary
+    import  cloudinary.uploader
 
+    cloudinary.config(
+        cloud_name=settings.cloudinary_cloud_name,
+        api_key=settings.cloudinary_api_key,
+        api_secret=settings.cloudinary_api_secret
+    )
+    return cloudinary.uploader
 
-async def create_upload_file(file: UploadFile = File(...)):
-    try:
-        upload_result = cloudinary.uploader.upload(file.file)
-        return  upload_result.get("url")
-    except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+
+def upload_to_cloudinary(fileobj, thumbnail_size):
+    # blocking, called from a worker thread. the thumbnail is an eager transformation
+    # so cloudinary renders it once at upload time
+    upload_result = cloudinary_uploader().upload(
+        fileobj,
+        resource_type='image',
+        eager=[{'width': thumbnail_size, 'height': thumbnail_size, 'crop': 'fill'}],
+    )
+    eager = upload_result.get('eager') or [{}]
+    return upload_result.get("url"), eager[0].get('url')
@@ -0,0 +1,206 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+import orjson
+from config import settings
+
+# TASK_EVENTS_BACKEND: memory (one worker) or redis (pub/sub, every worker sees
+# every event and hands it to its own subscribers)
+# TASK_EVENTS_BUFFER: events queued per connection. A client that falls that far
+# behind gets a final 'resync' event and is disconnected, it catches up through
+# /task/changes instead of growing the buffer
+
+CHANNEL = 'task-events'
+RESYNC = {'op': 'resync'}
+
+
+class Subscription:
+    def __init__(self, user_id, buffer):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=buffer)
+        self.closed = False
+
+    def push(self, event):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # slow consumer, drop what is buffered and tell it to resync
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            self.closed = True
+
+    async def get(self, timeout=None):
+        # None when nothing arrived within timeout
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class TaskEventBroker:
+    def __init__(self, backend=settings.task_events_backend, buffer=settings.task_events_buffer,
+                 url=settings.redis_url):
+        self.backend = backend
+        self.buffer = buffer
+        self.url = url
+        self.subscribers = {}
+        self._client = None
+        self._listener = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.url)
+        return self._client
+
+    async def start(self):
+        if self.backend == 'redis':
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @asynccontextmanager
+    async def subscribe(self, user_id):
+        subscription = Subscription(user_id, self.buffer)
+        self.subscribers.setdefault(user_id, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            subscriptions = self.subscribers.get(user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscribers[user_id]
+
+    def deliver(self, user_id, events):
+        for subscription in list(self.subscribers.get(user_id, ())):
+            for event in events:
+                subscription.push(event)
+
+    async def publish(self, user_id, events):
+        # called after the commit, a failed publish never fails the write
+        if not events:
+            return
+        if self.backend == 'redis':
+            try:
+                await self.client.publish(CHANNEL, orjson.dumps({'user_id': user_id, 'events': events}))
+                return
+            except Exception as e:
+                print(f'Task event publish failed: {str(e)}')
+        self.deliver(user_id, events)
+
+    async def _listen(self):
+        while True:
+            try:
+                async with self.client.pubsub() as pubsub:
+                    await pubsub.subscribe(CHANNEL)
+                    async for message in pubsub.listen():
+                        if message['type'] != 'message':
+                            continue
+                        payload = orjson.loads(message['data'])
+                        self.deliver(payload['user_id'], payload['events'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f'Task event listener failed: {str(e)}')
+                await asyncio.sleep(1)
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'users': len(self.subscribers),
+            'connections': sum(len(subscriptions) for subscriptions in self.subscribers.values()),
+        }
+
+
+task_events = TaskEventBroker()
+
+
+class StreamAccess:
+    # a push stream authenticates once, at connect. It ends when the token expires
+    # (expires_at, epoch seconds) and when authorized() turns false, which is asked
+    # again every `every` seconds, busy or idle
+
+    def __init__(self, expires_at=None, authorized=None, every=settings.task_events_ping):
+        self.expires_at = expires_at
+        self.authorized = authorized
+        self.every = every
+        self.next_check = time.monotonic() + every
+
+    def timeout(self, ping):
+        # wake up for the expiry even when no ping is due
+        if self.expires_at is None:
+            return ping
+        return max(min(ping, self.expires_at - time.time()), 0)
+
+    async def allowed(self):
+        if self.expires_at is not None and time.time() >= self.expires_at:
+            return False
+        if self.authorized is None or time.monotonic() < self.next_check:
+            return True
+        self.next_check = time.monotonic() + self.every
+        return await self.authorized()
+
+
+async def sse_stream(user_id, ping=settings.task_events_ping, access=None):
+    # text/event-stream body, a comment line every `ping` seconds keeps proxies from
+    # closing an idle stream. Starlette cancels the generator when the client leaves
+    access = access or StreamAccess()
+    async with task_events.subscribe(user_id) as subscription:
+        yield 'retry: 3000\n\n'
+        while True:
+            event = await subscription.get(access.timeout(ping))
+            if not await access.allowed():
+                # EventSource reconnects and gets the 401
+                return
+            if event is None:
+                yield ': ping\n\n'
+                continue
+            yield f"event: {event['op']}\ndata: {orjson.dumps(event).decode()}\n\n"
+            if event is RESYNC:
+                return
+
+
+async def _wait_disconnect(websocket):
+    # clients do not send anything, the receive side only notices them leaving
+    try:
+        while (await websocket.receive())['type'] != 'websocket.disconnect':
+            pass
+    except Exception:
+        pass
+
+
+async def websocket_stream(websocket, user_id, ping=settings.task_events_ping, access=None):
+    access = access or StreamAccess()
+    async with task_events.subscribe(user_id) as subscription:
+        disconnected = asyncio.create_task(_wait_disconnect(websocket))
+        try:
+            while True:
+                next_event = asyncio.create_task(subscription.get(access.timeout(ping)))
+                done, _ = await asyncio.wait({next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if next_event not in done:
+                    next_event.cancel()
+                    return
+                event = next_event.result()
+                if not await access.allowed():
+                    await websocket.close(code=1008)
+                    return
+                if event is None:
+                    continue
+                await websocket.send_text(orjson.dumps(event).decode())
+                if event is RESYNC:
+                    await websocket.close()
+                    return
+        finally:
+            disconnected.cancel()
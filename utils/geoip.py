@@ -0,0 +1,212 @@
+import asyncio
+import httpx
+from config import settings
+from utils.cache import TTLCache, MISSING
+from utils.metrics import external_call
+
+# GEOIP_RESOLVER picks what turns an ip into geo info: ip-api | stub | geoip2
+
+LOCAL_IPS = {'127.0.0.1', '::1', 'localhost'}
+
+
+# resolvers return {'country', 'regionName', 'city', 'lat', 'lon'} or None when the ip is unknown
+
+class IpApiResolver:
+    def __init__(self):
+        self.client = None
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    async def resolve(self, ip):
+        # one pooled client shared by every lookup, created on the first lookup so
+        # cold starts don't pay for it
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url='http://ip-api.com',
+                timeout=httpx.Timeout(3.0),
+                limits=httpx.Limits(max_connections=settings.geoip_workers,
+                                    max_keepalive_connections=settings.geoip_workers),
+            )
+        response = await self.client.get(f'/json/{ip}')
+        geo_info = response.json()
+        if geo_info.get('status') != 'success':
+            return None
+        return geo_info
+
+
+class StubResolver:
+    # offline resolver for local runs and benchmarks
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def resolve(self, ip):
+        return {'country': 'Unknown', 'regionName': 'Unknown', 'city': 'Unknown', 'lat': 0.0, 'lon': 0.0}
+
+
+class GeoIP2Resolver:
+    # reads a local MaxMind .mmdb file, needs the optional geoip2 package
+
+    def __init__(self, path):
+        self.path = path
+        self.reader = None
+
+    async def start(self):
+        import geoip2.database
+        self.reader = geoip2.database.Reader(self.path)
+
+    async def close(self):
+        if self.reader:
+            self.reader.close()
+
+    async def resolve(self, ip):
+        import geoip2.errors
+        try:
+            city = self.reader.city(ip)
+        except geoip2.errors.AddressNotFoundError:
+            return None
+        return {
+            'country': city.country.name,
+            'regionName': city.subdivisions.most_specific.name,
+            'city': city.city.name,
+            'lat': city.location.latitude,
+            'lon': city.location.longitude,
+        }
+
+
+def create_resolver(name=settings.geoip_resolver):
+    if name == 'stub':
+        return StubResolver()
+    if name == 'geoip2':
+        return GeoIP2Resolver(settings.geoip_database)
+    return IpApiResolver()
+
+
+def client_ip(request):
+    # best effort for the geo log only, X-Forwarded-For is whatever the client sent.
+    # rate limits key on utils.rate_limit.peer_ip instead
+    forwarded = request.headers.get('x-forwarded-for')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return request.client.host if request.client else None
+
+
+def format_log_entry(ip, geo_info):
+    return (
+        '-' * 150 + '\n' +
+        'IP: ' + ip + '\n' +
+        'Country: ' + str(geo_info['country']) +
+        ', Region: ' + str(geo_info['regionName']) +
+        ', City: ' + str(geo_info['city']) + '\n' +
+        'Latitude: ' + str(geo_info['lat']) + ', Longitude: ' + str(geo_info['lon']) + '\n' +
+        '-' * 150 + '\n'
+    )
+
+
+def write_lines(path, lines):
+    with open(path, 'a') as f:
+        f.writelines(lines)
+
+
+class GeoPipeline:
+    # the request path only calls enqueue(), lookups and log writes happen in background tasks
+
+    def __init__(self, resolver=None, queue_size=settings.geoip_queue_size, workers=settings.geoip_workers,
+                 log_file=settings.geoip_log_file, log_batch=settings.geoip_log_batch,
+                 log_interval=settings.geoip_log_interval):
+        self.resolver = resolver or create_resolver()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.log_queue = asyncio.Queue()
+        self.cache = TTLCache(maxsize=settings.geoip_cache_size, ttl=settings.geoip_cache_ttl)
+        self.workers = workers
+        self.log_file = log_file
+        self.log_batch = log_batch
+        self.log_interval = log_interval
+        self.dropped = 0
+        self._tasks = []
+
+    def enqueue(self, ip):
+        if not ip or ip in LOCAL_IPS:
+            return
+        try:
+            self.queue.put_nowait(ip)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def start(self):
+        await self.resolver.start()
+        self._tasks = [asyncio.create_task(self._lookup_worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._log_writer()))
+
+    async def drain(self):
+        await self.queue.join()
+        await self.log_queue.join()
+
+    async def stop(self, timeout=settings.geoip_drain_timeout):
+        # queued lookups and pending log lines get `timeout` seconds to finish, the rest
+        # is dropped so an unreachable resolver can't hold up shutdown
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+        except asyncio.TimeoutError:
+            print(f'Geo pipeline stopped, dropped {self.queue.qsize() + self.log_queue.qsize()} pending entries')
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.resolver.close()
+
+    async def lookup(self, ip):
+        geo_info = self.cache.get(ip, MISSING)
+        if geo_info is MISSING:
+            try:
+                async with external_call('geoip'):
+                    geo_info = await self.resolver.resolve(ip)
+            except Exception as e:
+                print(f'Geo lookup failed for {ip}: {str(e)}')
+                return None
+            self.cache.set(ip, geo_info)
+        return geo_info
+
+    async def _lookup_worker(self):
+        while True:
+            ip = await self.queue.get()
+            try:
+                geo_info = await self.lookup(ip)
+                if geo_info:
+                    self.log_queue.put_nowait(format_log_entry(ip, geo_info))
+            except Exception as e:
+                print(f'Geo enrichment error: {str(e)}')
+            finally:
+                self.queue.task_done()
+
+    async def _log_writer(self):
+        while True:
+            lines = [await self.log_queue.get()]
+            try:
+                deadline = asyncio.get_running_loop().time() + self.log_interval
+                while len(lines) < self.log_batch:
+                    timeout = deadline - asyncio.get_running_loop().time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        lines.append(await asyncio.wait_for(self.log_queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+
+                await asyncio.to_thread(write_lines, self.log_file, lines)
+            except Exception as e:
+                print(f'Geo log write failed: {str(e)}')
+            finally:
+                for _ in lines:
+                    self.log_queue.task_done()
+
+
+geo_pipeline = GeoPipeline()
@@ -0,0 +1,172 @@
+import asyncio
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import select, insert, update, delete, true
+from config import settings
+from database import engine, db_session
+from tables.task_tombstones import TaskTombstones
+from tables.tasks import Tasks, utc_now
+from tables.tasks_archive import TasksArchive
+from tables.users import Users
+from utils.api_response import serialize_task
+from utils.events import task_events
+from utils.scheduler import Scheduler
+from utils.stats import refresh_summary
+from utils.sync import delete_change, tombstone_rows
+from utils.task_version import bump_task_version
+
+# the periodic jobs. Every job works through its rows JOB_CHUNK_SIZE at a time, one
+# short transaction per chunk, so none of them holds locks on users / tasks for long.
+
+
+async def delete_in_chunks(model, *where, chunk_size=None):
+    chunk_size = chunk_size or settings.job_chunk_size
+    removed = 0
+    while True:
+        async with db_session() as db:
+            ids = (await db.scalars(select(model.id).where(*where).limit(chunk_size))).all()
+            if not ids:
+                return removed
+            await db.execute(delete(model).where(model.id.in_(ids)))
+            await db.commit()
+        removed += len(ids)
+        # let requests run between chunks
+        await asyncio.sleep(0)
+
+
+async def send_deadline_reminders():
+    # one `reminder` event per task whose deadline is less than REMINDER_LEAD_MINUTES
+    # away, pushed over /task/events and /task/ws. reminder_sent_at keeps it to one
+    # reminder per deadline, changing the deadline clears it
+    now = utc_now()
+    until = now + timedelta(minutes=settings.reminder_lead_minutes)
+    sent = 0
+    while True:
+        async with db_session() as db:
+            tasks = (await db.scalars(
+                select(Tasks)
+                .where(Tasks.deadline > now, Tasks.deadline <= until, Tasks.reminder_sent_at.is_(None))
+                .order_by(Tasks.deadline, Tasks.id)
+                .limit(settings.job_chunk_size)
+            )).all()
+            if not tasks:
+                return sent
+            # not a change of the task itself, updated_at stays as it was
+            await db.execute(
+                update(Tasks).where(Tasks.id.in_([task.id for task in tasks]))
+                .values(reminder_sent_at=now, updated_at=Tasks.updated_at)
+            )
+            await db.commit()
+
+        events = defaultdict(list)
+        for task in tasks:
+            events[task.owner_id].append({'op': 'reminder', 'task': serialize_task(task)})
+        for owner_id, owner_events in events.items():
+            await task_events.publish(owner_id, owner_events)
+
+        sent += len(tasks)
+        if len(tasks) < settings.job_chunk_size:
+            return sent
+
+
+async def purge_deleted_users():
+    # accounts soft deleted more than PURGE_DELETED_USERS_DAYS ago go away for good,
+    # their tasks first, chunk by chunk
+    cutoff = utc_now() - timedelta(days=settings.purge_deleted_users_days)
+    purged = 0
+    while True:
+        async with db_session() as db:
+            user_ids = (await db.scalars(
+                select(Users.id).where(Users.is_deleted == true(), Users.deleted_at < cutoff)
+                .limit(settings.job_chunk_size)
+            )).all()
+        if not user_ids:
+            return purged
+
+        for user_id in user_ids:
+            await delete_in_chunks(Tasks, Tasks.owner_id == user_id)
+            await delete_in_chunks(TasksArchive, TasksArchive.owner_id == user_id)
+            await delete_in_chunks(TaskTombstones, TaskTombstones.owner_id == user_id)
+            async with db_session() as db:
+                # restored in the meantime -> keep it
+                await db.execute(delete(Users).where(Users.id == user_id, Users.is_deleted == true()))
+                await db.commit()
+            purged += 1
+
+
+async def archive_old_tasks():
+    # tasks whose deadline passed more than ARCHIVE_AFTER_DAYS ago move to tasks_archive,
+    # so the per-user indexes on tasks only cover current work. Rows being written
+    # right now are skipped (FOR UPDATE SKIP LOCKED) and picked up on the next run
+    cutoff = utc_now() - timedelta(days=settings.archive_after_days)
+    columns = [column.name for column in TasksArchive.__table__.columns if column.name != 'archived_at']
+    moved = 0
+    while True:
+        async with db_session() as db:
+            candidates = (await db.execute(
+                select(Tasks.id, Tasks.owner_id).where(Tasks.deadline < cutoff)
+                .order_by(Tasks.deadline, Tasks.id)
+                .limit(settings.job_chunk_size)
+            )).all()
+            if not candidates:
+                return moved
+
+            # the owners' listings change, so their ETags must too. The users rows are
+            # locked before the task rows, in the same order as patch / delete / batch,
+            # so the job and a writer of the same owner can't deadlock
+            versions = await bump_task_version(db, *{owner_id for _, owner_id in candidates})
+            tasks = (await db.scalars(
+                select(Tasks).where(Tasks.id.in_([task_id for task_id, _ in candidates]), Tasks.deadline < cutoff)
+                .order_by(Tasks.deadline, Tasks.id)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not tasks:
+                # every candidate is being written, leaving the block rolls the bump back
+                return moved
+
+            now = utc_now()
+            await db.execute(insert(TasksArchive), [
+                {**{name: getattr(task, name) for name in columns}, 'archived_at': now} for task in tasks
+            ])
+            # to /task/changes and the push streams an archived task is a delete, a
+            # full sync leaves it out as well
+            tombstones = tombstone_rows([(task.id, task.owner_id) for task in tasks], versions)
+            await db.execute(insert(TaskTombstones), tombstones)
+            await db.execute(
+                delete(Tasks).where(Tasks.id.in_([task.id for task in tasks]))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+        events = defaultdict(list)
+        for row in tombstones:
+            events[row['owner_id']].append(delete_change(row['task_id'], row['version'], row['deleted_at']))
+        for owner_id, owner_events in events.items():
+            await task_events.publish(owner_id, owner_events)
+
+        moved += len(tasks)
+        if len(candidates) < settings.job_chunk_size:
+            return moved
+        await asyncio.sleep(0)
+
+
+async def compact_tombstones():
+    # cursors older than TASK_TOMBSTONE_DAYS are refused by /task/changes, so their
+    # tombstones are no longer needed
+    cutoff = utc_now() - timedelta(days=settings.task_tombstone_days)
+    return await delete_in_chunks(TaskTombstones, TaskTombstones.deleted_at < cutoff)
+
+
+async def refresh_task_stats():
+    # /admin/stats summaries, only scheduled with ADMIN_STATS_SOURCE=summary
+    async with db_session() as db:
+        return await refresh_summary(db)
+
+
+scheduler = Scheduler(engine, tick=settings.scheduler_tick)
+scheduler.add('deadline-reminders', settings.reminder_interval, send_deadline_reminders)
+scheduler.add('purge-deleted-users', settings.cleanup_interval, purge_deleted_users)
+scheduler.add('compact-tombstones', settings.cleanup_interval, compact_tombstones)
+scheduler.add('archive-old-tasks', settings.cleanup_interval, archive_old_tasks)
+if settings.admin_stats_source == 'summary':
+    scheduler.add('refresh-task-stats', settings.stats_refresh_interval, refresh_task_stats)
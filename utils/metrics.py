@@ -0,0 +1,219 @@
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from config import settings
+
+# request instrumentation: every query run by a request (async or sync db mode, the
+# threadpool copies the context) adds to that request's RequestStats, the middleware
+# turns them into per-route histograms served as prometheus text on /metrics.
+#
+# SLOW_QUERY_MS: print every query slower than this, with its sql
+# N_PLUS_ONE_THRESHOLD: print statements a single request ran at least this many
+# times, the usual sign of a query inside a loop
+# both are off by default
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_seconds', 'external_seconds', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.external_seconds = 0.0
+        self.statements = Counter() if settings.n_plus_one_threshold else None
+
+
+current_stats: ContextVar[RequestStats | None] = ContextVar('current_stats', default=None)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per bucket counts (+inf last), sum, count]
+        self.series = {}
+
+    def observe(self, values, value):
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for values, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket'
+                             f'{format_labels((*self.labels, "le"), (*values, bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, values)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, values)} {count}')
+        return lines
+
+
+request_duration = Histogram('http_request_duration_seconds', 'Total request time', ('method', 'route', 'status'))
+request_db_duration = Histogram('http_request_db_seconds', 'Time spent in database queries per request',
+                                ('method', 'route'))
+request_queries = Histogram('http_request_queries', 'Database queries per request', ('method', 'route'),
+                            buckets=QUERY_BUCKETS)
+request_external_duration = Histogram('http_request_external_seconds', 'Time spent in external calls per request',
+                                      ('method', 'route'))
+external_duration = Histogram('external_call_duration_seconds', 'External calls (geo lookups, avatar uploads)',
+                              ('target',))
+histograms = [request_duration, request_db_duration, request_queries, request_external_duration, external_duration]
+
+# queries outside requests (background jobs) included
+db_totals = {'queries': 0, 'seconds': 0.0}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    db_totals['queries'] += 1
+    db_totals['seconds'] += elapsed
+
+    stats = current_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        if stats.statements is not None:
+            stats.statements[statement] += 1
+
+    if settings.slow_query_ms is not None and elapsed * 1000 >= settings.slow_query_ms:
+        print(f'Slow query ({elapsed * 1000:.1f} ms): {statement}')
+
+
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+
+def instrument_engine(engine):
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+@asynccontextmanager
+async def external_call(target):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        external_duration.observe((target,), elapsed)
+        stats = current_stats.get()
+        if stats is not None:
+            stats.external_seconds += elapsed
+
+
+class MetricsMiddleware:
+    # plain ASGI so streamed responses are timed until their last chunk
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_stats.reset(token)
+            self.record(scope, status[0], time.perf_counter() - started, stats)
+
+    @staticmethod
+    def record(scope, status, elapsed, stats):
+        # the route template, not the raw path, keeps the label set bounded
+        route = getattr(scope.get('route'), 'path', 'unmatched')
+        method = scope['method']
+        request_duration.observe((method, route, str(status)), elapsed)
+        request_db_duration.observe((method, route), stats.db_seconds)
+        request_queries.observe((method, route), stats.queries)
+        request_external_duration.observe((method, route), stats.external_seconds)
+
+        if stats.statements:
+            for statement, count in stats.statements.items():
+                if count >= settings.n_plus_one_threshold:
+                    print(f'Possible N+1 on {method} {route}: {count}x {statement}')
+
+
+def gauge(lines, name, help, samples):
+    # samples: [(labels dict, value)]
+    lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+    for labels, value in samples:
+        lines.append(f'{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}')
+
+
+def render_metrics():
+    from database import pool_stats
+    from utils.events import task_events
+    from utils.geoip import geo_pipeline
+    from utils.jobs import scheduler
+    from utils.passwords import password_hasher
+
+    lines = []
+    for histogram in histograms:
+        lines += histogram.render()
+
+    lines += ['# HELP db_queries_total Queries run by every engine', '# TYPE db_queries_total counter',
+              f"db_queries_total {db_totals['queries']}",
+              '# HELP db_query_seconds_total Time spent in queries', '# TYPE db_query_seconds_total counter',
+              f"db_query_seconds_total {db_totals['seconds']}"]
+
+    pools = pool_stats()
+    for key in ('checked_out', 'checkouts', 'connects', 'timeouts', 'avg_wait_ms', 'max_wait_ms',
+                'size', 'overflow', 'idle'):
+        gauge(lines, f'db_pool_{key}', f'pool {key} per engine',
+              [({'engine': stats['engine']}, stats[key]) for stats in pools if key in stats])
+
+    hasher = password_hasher.stats()
+    for key in ('queue_depth', 'in_flight', 'completed', 'avg_wait_ms', 'avg_hash_ms'):
+        gauge(lines, f'password_hasher_{key}', f'password hasher {key}', [({}, hasher[key])])
+
+    gauge(lines, 'geoip_queue_depth', 'ips waiting for a geo lookup', [({}, geo_pipeline.queue.qsize())])
+    gauge(lines, 'geoip_dropped', 'ips dropped because the geo queue was full', [({}, geo_pipeline.dropped)])
+    gauge(lines, 'task_event_connections', 'open /task/events and /task/ws connections',
+          [({}, task_events.stats()['connections'])])
+
+    jobs = scheduler.stats()
+    gauge(lines, 'scheduler_leader', '1 when this worker runs the background jobs', [({}, int(jobs['leader']))])
+    for key in ('runs', 'failures', 'last_seconds'):
+        gauge(lines, f'job_{key}', f'background job {key}', [({'job': job['name']}, job[key]) for job in jobs['jobs']])
+
+    return '\n'.join(lines) + '\n'
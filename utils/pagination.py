@@ -0,0 +1,102 @@
+import base64
+import json
+from itertools import chain
+from datetime import datetime, date, timedelta
+from sqlalchemy import tuple_
+from tables.tasks import Tasks, utc_now
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, default=json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+# keyset pagination over tasks, every sort ends in Tasks.id so the order is total
+#   id       -> (owner_id, id) when the query is already filtered on one owner
+#   owner    -> (owner_id, id) across owners
+#   deadline -> (deadline, id), tasks without a deadline are left out
+
+# model is Tasks or TasksArchive, both have the same columns and indexes
+
+def task_keyset(stmt, sort='id', cursor=None, limit=DEFAULT_PAGE_SIZE, model=Tasks):
+    try:
+        if sort == 'deadline':
+            stmt = stmt.where(model.deadline.is_not(None)).order_by(model.deadline, model.id)
+            if cursor:
+                deadline, task_id = decode_cursor(cursor)
+                stmt = stmt.where(tuple_(model.deadline, model.id) > (datetime.fromisoformat(deadline), int(task_id)))
+        elif sort == 'owner':
+            stmt = stmt.order_by(model.owner_id, model.id)
+            if cursor:
+                owner_id, task_id = decode_cursor(cursor)
+                stmt = stmt.where(tuple_(model.owner_id, model.id) > (int(owner_id), int(task_id)))
+        else:
+            stmt = stmt.order_by(model.id)
+            if cursor:
+                (task_id,) = decode_cursor(cursor)
+                stmt = stmt.where(model.id > int(task_id))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+    # one extra row tells whether there is a next page
+    return stmt.limit(limit + 1)
+
+
+def task_sort_key(task, sort='id'):
+    if sort == 'deadline':
+        return task.deadline, task.id
+    if sort == 'owner':
+        return task.owner_id, task.id
+    return (task.id,)
+
+
+def task_cursor(task: Tasks, sort='id'):
+    return encode_cursor(*task_sort_key(task, sort))
+
+
+def merge_pages(pages, sort='id'):
+    # rows of one keyset query per table (hot tasks, archive) back in keyset order
+    return sorted(chain.from_iterable(pages), key=lambda task: task_sort_key(task, sort))
+
+
+def task_page(tasks, sort='id', limit=DEFAULT_PAGE_SIZE):
+    tasks = list(tasks)
+    next_cursor = task_cursor(tasks[limit - 1], sort) if len(tasks) > limit else None
+    return tasks[:limit], next_cursor
+
+
+def filter_deadline(stmt, deadline_from=None, deadline_to=None, model=Tasks):
+    if deadline_from is not None:
+        stmt = stmt.where(model.deadline >= deadline_from)
+    if deadline_to is not None:
+        stmt = stmt.where(model.deadline < deadline_to)
+    return stmt
+
+
+def due_window(window, hours=24):
+    # (deadline_from, deadline_to) for overdue | soon | next
+    now = utc_now()
+    if window == 'overdue':
+        return None, now
+    if window == 'soon':
+        return now, now + timedelta(hours=hours)
+    return now, None
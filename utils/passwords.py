@@ -0,0 +1,101 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from passlib.context import CryptContext
+from config import settings
+
+# PASSWORD_POOL: thread (bcrypt releases the GIL) or process
+# PASSWORD_MAX_CONCURRENCY: hashes allowed to run at once, the rest wait in line and
+# show up as queue depth
+# BCRYPT_ROUNDS: bcrypt cost, stored hashes with another cost are re-hashed on the
+# next successful login
+
+bcrypt_context = CryptContext(schemes=['bcrypt'], bcrypt__rounds=settings.bcrypt_rounds)
+
+
+# module level so they can be pickled into a process pool
+
+def _hash(password):
+    return bcrypt_context.hash(password)
+
+
+def _verify_and_update(password, hashed):
+    return bcrypt_context.verify_and_update(password, hashed)
+
+
+class PasswordHasher:
+    # runs bcrypt off the event loop in a bounded pool and keeps queue metrics
+
+    def __init__(self, pool=settings.password_pool, workers=settings.password_workers,
+                 max_concurrency=settings.password_concurrency):
+        self.pool = pool
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self._executor = None
+        self._semaphore = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.wait_seconds = 0.0
+        self.work_seconds = 0.0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.pool == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        started = time.perf_counter()
+        self.wait_seconds += started - queued
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.work_seconds += time.perf_counter() - started
+            self._semaphore.release()
+
+    async def hash(self, password):
+        return await self._run(_hash, password)
+
+    async def verify_and_update(self, password, hashed):
+        # returns (valid, new_hash), new_hash is set when the stored cost is out of date
+        if not hashed:
+            return False, None
+        return await self._run(_verify_and_update, password, hashed)
+
+    def stats(self):
+        return {
+            'pool': self.pool,
+            'workers': self.workers,
+            'max_concurrency': self.max_concurrency,
+            'rounds': settings.bcrypt_rounds,
+            'queue_depth': self.waiting,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'avg_wait_ms': round(self.wait_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+            'avg_hash_ms': round(self.work_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,141 @@
+import math
+import time
+from fastapi import HTTPException, Request
+from config import settings
+from utils.cache import TTLCache
+
+# RATE_LIMIT_BACKEND: memory (per process) or redis (shared by every worker)
+
+
+# token bucket: `capacity` requests in a burst, refilled at `rate` tokens per second.
+# returns (allowed, retry_after_seconds)
+
+class MemoryRateLimitBackend:
+    def __init__(self, max_keys=settings.rate_limit_max_keys):
+        self.buckets = TTLCache(maxsize=max_keys)
+
+    async def hit(self, key, capacity, rate, cost=1):
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+
+        # an untouched bucket is full again after this long, so it can be forgotten
+        self.buckets.set(key, (tokens, now), ttl=capacity / rate)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    async def reset(self, key):
+        self.buckets.delete(key)
+
+
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(retry_after)}
+"""
+
+
+class RedisRateLimitBackend:
+    prefix = 'ratelimit:'
+
+    def __init__(self, url=settings.redis_url):
+        self.url = url
+        self._client = None
+        self._script = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    @property
+    def script(self):
+        # registered once, runs atomically through EVALSHA
+        if self._script is None:
+            self._script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+        return self._script
+
+    async def hit(self, key, capacity, rate, cost=1):
+        allowed, retry_after = await self.script(keys=[self.prefix + key], args=[capacity, rate, cost])
+        return bool(int(allowed)), float(retry_after)
+
+    async def reset(self, key):
+        await self.client.delete(self.prefix + key)
+
+
+def create_backend(name=settings.rate_limit_backend):
+    if name == 'redis':
+        return RedisRateLimitBackend()
+    return MemoryRateLimitBackend()
+
+
+default_backend = create_backend()
+
+
+def peer_ip(request):
+    # the address of the connection, never a client supplied X-Forwarded-For. Behind a
+    # reverse proxy uvicorn puts the real client here, but only for proxies listed in
+    # FORWARDED_ALLOW_IPS (uvicorn's own setting, 127.0.0.1 by default)
+    return request.client.host if request.client else None
+
+
+class RateLimiter:
+    # `times` requests every `seconds`, usable directly as a route dependency
+    # (keyed by client ip) or called with any identity (email, user id, ...)
+
+    def __init__(self, name, times, seconds, backend=None):
+        self.name = name
+        self.capacity = times
+        self.rate = times / seconds
+        self.backend = backend or default_backend
+
+    async def hit(self, identity):
+        try:
+            return await self.backend.hit(f'{self.name}:{identity}', self.capacity, self.rate)
+        except Exception as e:
+            # fail open, an unreachable limiter backend must not lock everybody out
+            print(f'Rate limiter error: {str(e)}')
+            return True, 0.0
+
+    async def reset(self, identity):
+        try:
+            await self.backend.reset(f'{self.name}:{identity}')
+        except Exception as e:
+            print(f'Rate limiter reset error: {str(e)}')
+
+    async def check(self, identity):
+        allowed, retry_after = await self.hit(identity)
+        if not allowed:
+            raise HTTPException(
+                status_code=429,
+                detail='Too many requests',
+                headers={'Retry-After': str(math.ceil(retry_after))},
+            )
+
+    async def __call__(self, request: Request):
+        await self.check(peer_ip(request) or 'unknown')
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+# in-process periodic jobs. With several workers (or hosts) only the one holding the
+# scheduler lock runs them: pg_try_advisory_lock on postgres, GET_LOCK on mysql. The
+# lock lives as long as the session, so the leader keeps one pooled connection open
+# and a new leader takes over on the next tick when it goes away. Session locks do
+# not survive transaction pooling, point DATABASE_URL past pgbouncer for the leader.
+# sqlite is single host, every worker there is a leader.
+
+SCHEDULER_LOCK_ID = 724502
+SCHEDULER_LOCK_NAME = 'tasks-fastapi-scheduler'
+
+
+class LeaderLock:
+    def __init__(self, engine):
+        self.engine = engine
+        self.conn = None
+
+    @property
+    def supported(self):
+        return self.engine.dialect.name in ('postgresql', 'mysql')
+
+    async def acquire(self):
+        if not self.supported:
+            return True
+        return await run_in_threadpool(self._acquire)
+
+    def _acquire(self):
+        if self.conn is not None:
+            try:
+                self.conn.execute(text('SELECT 1'))
+                self.conn.commit()
+                return True
+            except Exception as e:
+                print(f'Scheduler lost its lock connection: {str(e)}')
+                self._close()
+
+        conn = self.engine.connect()
+        try:
+            if self.engine.dialect.name == 'postgresql':
+                acquired = conn.execute(text('SELECT pg_try_advisory_lock(:id)'), {'id': SCHEDULER_LOCK_ID}).scalar()
+            else:
+                acquired = conn.execute(text('SELECT GET_LOCK(:name, 0)'), {'name': SCHEDULER_LOCK_NAME}).scalar() == 1
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+
+        if acquired:
+            self.conn = conn
+        else:
+            conn.close()
+        return bool(acquired)
+
+    async def release(self):
+        if self.conn is not None:
+            await run_in_threadpool(self._close)
+
+    def _close(self):
+        # closing the session frees the lock
+        try:
+            self.conn.invalidate()
+            self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+
+    @property
+    def held(self):
+        return self.conn is not None or not self.supported
+
+
+class Job:
+    def __init__(self, name, interval, fn):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.next_run = 0.0
+        self.runs = 0
+        self.failures = 0
+        self.last_result = None
+        self.last_seconds = 0.0
+
+
+class Scheduler:
+    def __init__(self, engine, tick=10):
+        self.lock = LeaderLock(engine)
+        self.tick = tick
+        self.jobs = []
+        self._task = None
+
+    def add(self, name, interval, fn):
+        self.jobs.append(Job(name, interval, fn))
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.lock.release()
+
+    async def _run(self):
+        while True:
+            try:
+                if await self.lock.acquire():
+                    for job in self.jobs:
+                        if time.monotonic() >= job.next_run:
+                            await self.run_job(job)
+            except Exception as e:
+                print(f'Scheduler tick failed: {str(e)}')
+            await asyncio.sleep(self.tick)
+
+    async def run_job(self, job):
+        started = time.monotonic()
+        try:
+            job.last_result = await job.fn()
+            if job.last_result:
+                print(f'Job {job.name}: {job.last_result}')
+        except Exception as e:
+            job.failures += 1
+            print(f'Job {job.name} failed: {str(e)}')
+        finally:
+            job.runs += 1
+            job.last_seconds = time.monotonic() - started
+            job.next_run = started + job.interval
+
+    def stats(self):
+        return {
+            'leader': self.lock.held,
+            'jobs': [
+                {'name': job.name, 'runs': job.runs, 'failures': job.failures,
+                 'last_seconds': round(job.last_seconds, 3), 'last_result': job.last_result}
+                for job in self.jobs
+            ],
+        }
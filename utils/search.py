@@ -0,0 +1,60 @@
+import re
+from sqlalchemy import select, func, literal, literal_column, table, column, and_, or_
+from tables.tasks import Tasks
+from utils.pagination import decode_cursor, encode_cursor
+
+# words after the first MAX_TERMS are ignored
+MAX_TERMS = 8
+
+
+def search_terms(q: str):
+    # only word characters reach the query, every term is prefix matched
+    return re.findall(r'\w+', q.lower())[:MAX_TERMS]
+
+
+def task_search(dialect, terms, owner_id=None, cursor=None, limit=20):
+    # ranked search, best match first. postgres uses the generated tsvector column and
+    # its GIN index, sqlite the tasks_fts table (migration 0004), anything else LIKE.
+    # returns a select of (Tasks, score), keyset paginated on (score, id)
+    if dialect == 'postgresql':
+        query = func.to_tsquery('simple', ' & '.join(f'{term}:*' for term in terms))
+        vector = literal_column('tasks.search_vector')
+        score = func.ts_rank_cd(vector, query)
+        stmt = select(Tasks, score.label('score')).where(vector.op('@@')(query))
+
+    elif dialect == 'sqlite':
+        fts = table('tasks_fts', column('rowid'))
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # bm25 is lower for better matches, flip it so every dialect sorts descending
+        score = -func.bm25(literal_column('tasks_fts'))
+        stmt = (select(Tasks, score.label('score'))
+                .join(fts, fts.c.rowid == Tasks.id)
+                .where(literal_column('tasks_fts').op('MATCH')(match)))
+
+    else:
+        score = literal(0.0)
+        stmt = select(Tasks, score.label('score')).where(and_(*[
+            or_(Tasks.title.ilike(f'%{term}%'), Tasks.description.ilike(f'%{term}%')) for term in terms
+        ]))
+
+    if owner_id is not None:
+        stmt = stmt.where(Tasks.owner_id == owner_id)
+
+    if cursor:
+        try:
+            last_score, last_id = decode_cursor(cursor)
+            last_score, last_id = float(last_score), int(last_id)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid cursor')
+        stmt = stmt.where(or_(score < last_score, and_(score == last_score, Tasks.id < last_id)))
+
+    return stmt.order_by(score.desc(), Tasks.id.desc()).limit(limit + 1)
+
+
+def search_page(rows, limit):
+    rows = list(rows)
+    next_cursor = None
+    if len(rows) > limit:
+        task, score = rows[limit - 1]
+        next_cursor = encode_cursor(score, task.id)
+    return rows[:limit], next_cursor
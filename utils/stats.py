@@ -0,0 +1,189 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, insert, delete, func, case, cast, and_, Date
+from config import settings
+from tables.task_deadline_stats import TaskDeadlineStats
+from tables.task_stats import TaskStats
+from tables.tasks import Tasks, utc_now
+from tables.tasks_archive import TasksArchive
+from tables.users import Users
+
+# admin dashboard numbers. Everything is a GROUP BY aggregate, the database sends one
+# row per group (user, account flags, deadline day) and never the rows themselves.
+# ADMIN_STATS_SOURCE:
+#   live    -> aggregate tasks / tasks_archive on every request
+#   summary -> read task_stats / task_deadline_stats, rebuilt by the stats job every
+#              STATS_REFRESH_INTERVAL seconds, a dashboard then reads O(users) and
+#              O(days) rows. Until the first rebuild the live numbers are served
+
+DUE_SOON_HOURS = 24
+
+
+def deadline_day(dialect, column):
+    # sqlite keeps datetimes as text, CAST would turn them into a number
+    if dialect == 'sqlite':
+        return func.date(column)
+    return cast(column, Date)
+
+
+def as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def bucket_start(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def rollup(days, bucket):
+    # days: {day: [tasks, archived]} -> one entry per day / week (monday) / month
+    buckets = {}
+    for day, (tasks, archived) in days.items():
+        counts = buckets.setdefault(bucket_start(day, bucket), [0, 0])
+        counts[0] += tasks
+        counts[1] += archived
+    return [{'start': start, 'tasks': tasks, 'archived': archived}
+            for start, (tasks, archived) in sorted(buckets.items())]
+
+
+def empty_counts():
+    return {'tasks': 0, 'overdue': 0, 'due_soon': 0, 'archived': 0}
+
+
+async def user_totals(db):
+    rows = (await db.execute(
+        select(Users.is_deleted, Users.is_admin, func.count()).group_by(Users.is_deleted, Users.is_admin)
+    )).all()
+    totals = {'total': 0, 'active': 0, 'soft_deleted': 0, 'admins': 0}
+    for is_deleted, is_admin, count in rows:
+        totals['total'] += count
+        totals['soft_deleted' if is_deleted else 'active'] += count
+        if is_admin and not is_deleted:
+            totals['admins'] += count
+    return totals
+
+
+async def live_owner_counts(db, now, owner_ids=None):
+    # {owner_id: counts}, every owner when owner_ids is None
+    soon = now + timedelta(hours=DUE_SOON_HOURS)
+    counts = {}
+
+    stmt = select(
+        Tasks.owner_id,
+        func.count(),
+        func.sum(case((Tasks.deadline < now, 1), else_=0)),
+        func.sum(case((and_(Tasks.deadline >= now, Tasks.deadline < soon), 1), else_=0)),
+    ).group_by(Tasks.owner_id)
+    if owner_ids is not None:
+        stmt = stmt.where(Tasks.owner_id.in_(owner_ids))
+    for owner_id, tasks, overdue, due_soon in (await db.execute(stmt)).all():
+        counts[owner_id] = {**empty_counts(), 'tasks': tasks, 'overdue': overdue or 0, 'due_soon': due_soon or 0}
+
+    stmt = select(TasksArchive.owner_id, func.count()).group_by(TasksArchive.owner_id)
+    if owner_ids is not None:
+        stmt = stmt.where(TasksArchive.owner_id.in_(owner_ids))
+    for owner_id, archived in (await db.execute(stmt)).all():
+        counts.setdefault(owner_id, empty_counts())['archived'] = archived
+
+    return counts
+
+
+async def live_deadline_days(db, deadline_from=None, deadline_to=None):
+    # {day: [tasks, archived]}
+    dialect = db.bind.dialect.name
+    days = {}
+    for position, model in enumerate((Tasks, TasksArchive)):
+        day = deadline_day(dialect, model.deadline)
+        stmt = select(day, func.count()).where(model.deadline.is_not(None)).group_by(day)
+        if deadline_from is not None:
+            stmt = stmt.where(model.deadline >= deadline_from)
+        if deadline_to is not None:
+            stmt = stmt.where(model.deadline < deadline_to)
+        for value, count in (await db.execute(stmt)).all():
+            days.setdefault(as_date(value), [0, 0])[position] += count
+    return days
+
+
+async def summary_refreshed_at(db):
+    # None until the stats job has run, the callers fall back to live numbers
+    if settings.admin_stats_source != 'summary':
+        return None
+    return await db.scalar(select(func.max(TaskStats.refreshed_at)))
+
+
+async def task_totals(db):
+    # (totals, refreshed_at), refreshed_at is None for live numbers
+    refreshed_at = await summary_refreshed_at(db)
+    if refreshed_at is not None:
+        row = (await db.execute(select(
+            func.sum(TaskStats.tasks), func.sum(TaskStats.overdue),
+            func.sum(TaskStats.due_soon), func.sum(TaskStats.archived),
+        ))).one()
+        return dict(zip(('tasks', 'overdue', 'due_soon', 'archived'), (value or 0 for value in row))), refreshed_at
+
+    now = utc_now()
+    soon = now + timedelta(hours=DUE_SOON_HOURS)
+    row = (await db.execute(select(
+        func.count(),
+        func.sum(case((Tasks.deadline < now, 1), else_=0)),
+        func.sum(case((and_(Tasks.deadline >= now, Tasks.deadline < soon), 1), else_=0)),
+    ))).one()
+    archived = await db.scalar(select(func.count()).select_from(TasksArchive))
+    return {'tasks': row[0], 'overdue': row[1] or 0, 'due_soon': row[2] or 0, 'archived': archived}, None
+
+
+async def owner_counts(db, owner_ids):
+    # counts for one page of users, owners without tasks get zeros
+    refreshed_at = await summary_refreshed_at(db)
+    if refreshed_at is not None:
+        rows = (await db.scalars(select(TaskStats).where(TaskStats.owner_id.in_(owner_ids)))).all()
+        counts = {row.owner_id: {'tasks': row.tasks, 'overdue': row.overdue, 'due_soon': row.due_soon,
+                                 'archived': row.archived} for row in rows}
+    else:
+        counts = await live_owner_counts(db, utc_now(), owner_ids)
+    return {owner_id: counts.get(owner_id, empty_counts()) for owner_id in owner_ids}, refreshed_at
+
+
+async def deadline_histogram(db, bucket='day', deadline_from=None, deadline_to=None):
+    refreshed_at = await summary_refreshed_at(db)
+    if refreshed_at is None:
+        return rollup(await live_deadline_days(db, deadline_from, deadline_to), bucket), None
+
+    stmt = select(TaskDeadlineStats.day, TaskDeadlineStats.tasks, TaskDeadlineStats.archived)
+    # whole days only, the summary has no finer grain
+    if deadline_from is not None:
+        stmt = stmt.where(TaskDeadlineStats.day >= deadline_from.date())
+    if deadline_to is not None:
+        stmt = stmt.where(TaskDeadlineStats.day <= deadline_to.date())
+    days = {day: [tasks, archived] for day, tasks, archived in (await db.execute(stmt)).all()}
+    return rollup(days, bucket), refreshed_at
+
+
+async def refresh_summary(db):
+    # rebuilds both summary tables in one transaction, readers see the old rows until
+    # the commit. Returns the number of owners summarized
+    now = utc_now()
+    # tasks without an owner have no row to go in
+    owners = {owner_id: counts for owner_id, counts in (await live_owner_counts(db, now)).items()
+              if owner_id is not None}
+    days = await live_deadline_days(db)
+
+    await db.execute(delete(TaskStats))
+    await db.execute(delete(TaskDeadlineStats))
+    if owners:
+        await db.execute(insert(TaskStats), [
+            {'owner_id': owner_id, **counts, 'refreshed_at': now} for owner_id, counts in owners.items()
+        ])
+    if days:
+        await db.execute(insert(TaskDeadlineStats), [
+            {'day': day, 'tasks': tasks, 'archived': archived, 'refreshed_at': now}
+            for day, (tasks, archived) in days.items()
+        ])
+    await db.commit()
+    return len(owners)
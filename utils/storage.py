@@ -0,0 +1,140 @@
+import os
+import tempfile
+import uuid
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from config import settings
+from utils.metrics import external_call
+
+CHUNK_SIZE = 64 * 1024
+
+# starlette has received and spooled the whole multipart body before a handler runs,
+# so AVATAR_MAX_BYTES only decides what gets stored. Cap the request body at the proxy
+# (e.g. nginx client_max_body_size) to stop oversized uploads from being received
+
+# leading bytes -> extension, the declared content type is not trusted
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+
+class UploadError(ValueError):
+    pass
+
+
+def sniff_image(head: bytes):
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+async def check_upload(file: UploadFile, max_bytes=settings.avatar_max_bytes):
+    # size from the spooled upload and type from its first chunk, then rewinds it.
+    # Returns the detected extension
+    size = file.size
+    if size is None:
+        size = await run_in_threadpool(file.file.seek, 0, os.SEEK_END)
+    if size > max_bytes:
+        raise UploadError(f'Avatar must be smaller than {max_bytes // (1024 * 1024)} MB')
+
+    await file.seek(0)
+    head = await file.read(CHUNK_SIZE)
+    await file.seek(0)
+    if not head:
+        raise UploadError('Avatar file is empty')
+    ext = sniff_image(head)
+    if ext is None:
+        raise UploadError('Avatar must be a JPEG, PNG, GIF or WEBP image')
+    return ext
+
+
+async def copy_upload(file: UploadFile, sink):
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        await run_in_threadpool(sink.write, chunk)
+
+
+def make_thumbnail(source, target, size):
+    try:
+        from PIL import Image
+    except ImportError:
+        print('Pillow is not installed, skipping avatar thumbnail')
+        return False
+
+    with Image.open(source) as image:
+        image.thumbnail((size, size))
+        image.save(target)
+    return True
+
+
+class LocalStorage:
+    # files under LOCAL_STORAGE_DIR, served by main.py at LOCAL_STORAGE_URL
+
+    def __init__(self, root=settings.local_storage_dir, base_url=settings.local_storage_url):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+
+    async def save_avatar(self, file: UploadFile):
+        folder = os.path.join(self.root, 'avatars')
+        os.makedirs(folder, exist_ok=True)
+        name = uuid.uuid4().hex
+
+        ext = await check_upload(file)
+        tmp = tempfile.NamedTemporaryFile(dir=folder, suffix='.part', delete=False)
+        try:
+            with tmp:
+                await copy_upload(file, tmp)
+            path = os.path.join(folder, f'{name}.{ext}')
+            os.replace(tmp.name, path)
+        except Exception:
+            os.unlink(tmp.name)
+            raise
+
+        thumb_url = None
+        thumb_path = os.path.join(folder, f'{name}_thumb.{ext}')
+        try:
+            if await run_in_threadpool(make_thumbnail, path, thumb_path, settings.avatar_thumbnail_size):
+                thumb_url = f'{self.base_url}/avatars/{name}_thumb.{ext}'
+        except Exception:
+            os.unlink(path)
+            raise UploadError('Avatar is not a valid image')
+
+        return f'{self.base_url}/avatars/{name}.{ext}', thumb_url
+
+
+class CloudinaryStorage:
+    async def save_avatar(self, file: UploadFile):
+        from utils.cloudinary_upload import upload_to_cloudinary
+
+        await check_upload(file)
+        # starlette's spooled file goes to the sdk as is, no second copy. The sdk is
+        # blocking, keep it off the event loop
+        async with external_call('cloudinary'):
+            return await run_in_threadpool(upload_to_cloudinary, file.file, settings.avatar_thumbnail_size)
+
+
+def create_storage(name=settings.storage_backend):
+    if name == 'local':
+        return LocalStorage()
+    return CloudinaryStorage()
+
+
+storage = create_storage()
+
+
+async def save_avatar(file: UploadFile):
+    # returns (url, thumbnail_url), raises UploadError for files we refuse
+    try:
+        return await storage.save_avatar(file)
+    except UploadError:
+        raise
+    except Exception as e:
+        raise UploadError(f'Avatar upload failed: {str(e)}')
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, tuple_
+from config import settings
+from tables.tasks import Tasks, utc_now
+from tables.task_tombstones import TaskTombstones
+from utils.api_response import serialize_task
+from utils.pagination import encode_cursor, decode_cursor
+
+# delta sync for /task/changes. Every task write stamps the rows it touches (and the
+# tombstones of deleted tasks) with the owner's new users.task_version, so changes
+# are read in (version, task_id) order. The cursor is that position plus the time
+# it was handed out; cursors older than the tombstone retention may have missed
+# compacted deletes and are refused.
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def changes_cursor(version, task_id):
+    return encode_cursor(version, task_id, utc_now())
+
+
+def parse_changes_cursor(since):
+    try:
+        version, task_id, issued_at = decode_cursor(since)
+        version, task_id, issued_at = int(version), int(task_id), datetime.fromisoformat(issued_at)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if issued_at < utc_now() - timedelta(days=settings.task_tombstone_days):
+        raise CursorExpired('Cursor expired, fetch the full task list again')
+    return version, task_id
+
+
+# change entries, shared by /task/changes and the push channel
+
+def upsert_change(task):
+    return {'op': 'upsert', 'version': task.version, 'task': serialize_task(task)}
+
+
+def delete_change(task_id, version, deleted_at):
+    return {'op': 'delete', 'version': version, 'task_id': task_id, 'deleted_at': deleted_at}
+
+
+async def task_changes(db, owner_id, since=None, limit=100):
+    # since=None is the initial sync: every live task, no tombstones
+    version, task_id = parse_changes_cursor(since) if since else (0, 0)
+
+    tasks = (await db.scalars(
+        select(Tasks)
+        .where(Tasks.owner_id == owner_id, tuple_(Tasks.version, Tasks.id) > (version, task_id))
+        .order_by(Tasks.version, Tasks.id)
+        .limit(limit + 1)
+    )).all()
+    changes = [(task.version, task.id, upsert_change(task)) for task in tasks]
+
+    if since:
+        tombstones = (await db.scalars(
+            select(TaskTombstones)
+            .where(TaskTombstones.owner_id == owner_id,
+                   tuple_(TaskTombstones.version, TaskTombstones.task_id) > (version, task_id))
+            .order_by(TaskTombstones.version, TaskTombstones.task_id)
+            .limit(limit + 1)
+        )).all()
+        changes += [(tomb.version, tomb.task_id, delete_change(tomb.task_id, tomb.version, tomb.deleted_at))
+                    for tomb in tombstones]
+
+    changes.sort(key=lambda change: change[:2])
+    page = changes[:limit]
+    if page:
+        version, task_id = page[-1][:2]
+
+    return [change[2] for change in page], changes_cursor(version, task_id), len(changes) > limit
+
+
+def tombstone_rows(deleted, versions):
+    # deleted: [(task_id, owner_id)]
+    deleted_at = utc_now()
+    return [{'task_id': task_id, 'owner_id': owner_id, 'version': versions.get(owner_id, 0), 'deleted_at': deleted_at}
+            for task_id, owner_id in deleted]
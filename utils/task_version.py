@@ -0,0 +1,69 @@
+import hashlib
+from fastapi.responses import Response
+from sqlalchemy import select, update
+from config import settings
+from tables.users import Users
+from utils.cache import create_cache
+
+# every write to a user's tasks bumps users.task_version in the same transaction, so
+# (owner, version, query params) names one exact task listing. Polls that send the
+# ETag back in If-None-Match get a 304 after a single version lookup, and rendered
+# listings are cached under the same key. TASK_LIST_CACHE = memory | redis | off
+
+listing_cache = create_cache(
+    settings.task_list_cache,
+    prefix='tasks:',
+    maxsize=settings.task_list_cache_size,
+    ttl=settings.task_list_cache_ttl,
+)
+
+
+async def bump_task_version(db, *owner_ids):
+    # call before the task write and commit with it. Returns {owner_id: new version}
+    # so the written rows can be stamped; the row lock taken by the UPDATE orders
+    # concurrent writers of one owner, which keeps versions in commit order
+    owner_ids = {owner_id for owner_id in owner_ids if owner_id is not None}
+    if not owner_ids:
+        return {}
+    await db.execute(
+        update(Users).where(Users.id.in_(owner_ids)).values(task_version=Users.task_version + 1)
+    )
+    return dict((await db.execute(select(Users.id, Users.task_version).where(Users.id.in_(owner_ids)))).all())
+
+
+async def get_task_version(db, owner_id):
+    return await db.scalar(select(Users.task_version).where(Users.id == owner_id))
+
+
+def listing_key(owner_id, version, *params):
+    digest = hashlib.blake2b(repr(params).encode(), digest_size=8).hexdigest()
+    return f'{owner_id}.{version}.{digest}'
+
+
+def listing_etag(key):
+    return f'W/"{key}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return etag.removeprefix('W/') in tags
+
+
+def not_modified(etag):
+    return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
+
+def cached_listing(body, etag):
+    return Response(content=body, media_type='application/json',
+                    headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
+
+async def store_listing(key, etag, response):
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    await listing_cache.set(key, response.body.decode())
+    return response
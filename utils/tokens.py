@@ -0,0 +1,100 @@
+import datetime
+import time
+import uuid
+from jose import jwt
+from config import settings
+from utils.cache import create_cache
+
+# access tokens carry everything get_current_user needs (user id, email, role and the
+# user's token version), so an authenticated request does not load the user. They
+# live ACCESS_TOKEN_MINUTES; refresh tokens live REFRESH_TOKEN_DAYS, can only be
+# used on /user/refresh and are checked against the database there.
+#
+# revocation is two O(1) lookups in TOKEN_REVOCATION_BACKEND (memory | redis):
+#   revocations     jti:<id>, a single revoked token (logout, rotated refresh token),
+#                   at most TOKEN_REVOCATION_SIZE of them in memory
+#   token_versions  <user id> -> the user's current token version, older tokens are
+#                   rejected. Never evicted: dropping one would quietly accept every
+#                   token issued before a password change or delete again. When redis
+#                   can't be asked the token counts as revoked
+# entries only need to outlive the tokens they reject. With the memory backend a
+# revocation is only seen by the worker that made it, use redis with several workers.
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+revocations = create_cache(
+    settings.token_revocation_backend,
+    prefix='revoked:',
+    maxsize=settings.token_revocation_size,
+    ttl=settings.refresh_token_days * 24 * 60 * 60,
+)
+token_versions = create_cache(
+    settings.token_revocation_backend,
+    prefix='token-version:',
+    maxsize=None,
+    ttl=settings.refresh_token_days * 24 * 60 * 60,
+    strict=True,
+)
+
+
+def create_token(user, kind, lifetime: datetime.timedelta):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    claims = {
+        'sub': str(user.id),
+        'email': user.email,
+        'role': 'admin' if user.is_admin else 'user',
+        'tv': user.token_version or 0,
+        'type': kind,
+        'jti': uuid.uuid4().hex,
+        'iat': now,
+        'exp': now + lifetime,
+    }
+    return jwt.encode(claims, settings.secret_key, algorithm=settings.algo)
+
+
+def issue_tokens(user):
+    return {
+        'access_token': create_token(user, ACCESS, datetime.timedelta(minutes=settings.access_token_minutes)),
+        'refresh_token': create_token(user, REFRESH, datetime.timedelta(days=settings.refresh_token_days)),
+        'token_type': 'bearer',
+        'expires_in': settings.access_token_minutes * 60,
+    }
+
+
+def decode_token(token):
+    # raises JWTError for a bad signature or an expired token
+    return jwt.decode(token, settings.secret_key, algorithms=[settings.algo])
+
+
+def principal_from_claims(payload):
+    return {
+        'email': payload.get('email'),
+        'user_id': int(payload['sub']),
+        'role': payload.get('role', 'user'),
+        'is_deleted': False,
+    }
+
+
+def seconds_left(payload):
+    return max(int(payload.get('exp', 0) - time.time()), 1)
+
+
+async def is_revoked(payload):
+    if await revocations.get(f"jti:{payload.get('jti')}") is not None:
+        return True
+    try:
+        version = await token_versions.get(payload.get('sub'))
+    except Exception:
+        # fail closed, RedisCache already logged the outage
+        return True
+    return version is not None and payload.get('tv', 0) < int(version)
+
+
+async def revoke_token(payload):
+    await revocations.set(f"jti:{payload.get('jti')}", 1, ttl=seconds_left(payload))
+
+
+async def revoke_user_tokens(user_id, token_version):
+    # every token issued before the bump carries a lower version
+    await token_versions.set(str(user_id), token_version)